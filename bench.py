@@ -0,0 +1,575 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the system monitor collectors
+Times the process table backends against a growing number of processes
+and checks that they report the same per-user aggregates, checks the
+cgroup user accounting against a fake cgroupfs tree, times collection
+and serving against synthetic process tables of up to tens of thousands
+of processes, and load-tests a running server with polling clients and
+idle stream viewers (`serve` runs one on synthetic sources). Pass
+--record to append results to a JSON lines file tagged with the commit,
+and `compare` to flag regressions between recorded runs
+"""
+
+import os
+import json
+import time
+import random
+import socket
+import sys
+import shutil
+import asyncio
+import platform
+import tempfile
+import argparse
+import subprocess
+from statistics import median
+from urllib.parse import urlsplit
+
+import run
+
+def spawn_idle_processes(count):
+    """Start `count` sleeping processes to grow the process table"""
+    return [subprocess.Popen(['sleep', '600']) for _ in range(count)]
+
+def stop_processes(procs):
+    """Terminate and reap processes started by spawn_idle_processes"""
+    for proc in procs:
+        proc.kill()
+    for proc in procs:
+        proc.wait()
+
+def time_scan(table, repeats):
+    """Median seconds for a full scan of an already warmed-up table"""
+    for _ in table.scan():
+        pass
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        for _ in table.scan():
+            pass
+        timings.append(time.perf_counter() - started)
+    return median(timings)
+
+def check_backend_parity(backends):
+    """Compare per-user aggregates from every backend against psutil"""
+    # A busy process gives its user a CPU total worth comparing
+    busy = subprocess.Popen([sys.executable, '-c', 'while True: pass'])
+    try:
+        return _check_backend_parity(backends)
+    finally:
+        stop_processes([busy])
+
+def _check_backend_parity(backends):
+    tables = {name: backend() for name, backend in backends.items()}
+    samples = {name: {proc.pid: proc for proc in table.scan()} for name, table in tables.items()}
+    ok = True
+    for name, by_pid in samples.items():
+        for pid in by_pid.keys() & samples['psutil'].keys():
+            expected = samples['psutil'][pid]
+            actual = by_pid[pid]
+            if (actual.username, actual.name, actual.ppid, actual.pgid) != \
+                    (expected.username, expected.name, expected.ppid, expected.pgid):
+                print(f"  parity mismatch [{name}] pid {pid}: {actual} != {expected}")
+                ok = False
+    # Second pass so every backend has a CPU baseline
+    time.sleep(0.5)
+    results = {name: run.get_user_processes(table) for name, table in tables.items()}
+
+    reference = {user['username']: user for user in results['psutil']}
+    for name, users in results.items():
+        by_name = {user['username']: user for user in users}
+        for username in reference.keys() & by_name.keys():
+            # Scans run moments apart, so allow a little drift: processes grow, and the
+            # CPU windows are offset by the time each scan takes
+            for field, slack, share in (('memory_usage', 0.5, 0.05), ('cpu_usage', 10.0, 0.1)):
+                expected = reference[username][field]
+                actual = by_name[username][field]
+                if abs(expected - actual) > max(slack, expected * share):
+                    print(f"  parity mismatch [{name}] {username}: {field} {actual:.2f}% != {expected:.2f}%")
+                    ok = False
+        missing = set(reference) ^ set(by_name)
+        if missing:
+            print(f"  users only reported by one of psutil/{name}: {sorted(missing)}")
+    return ok
+
+def bench_process_backends(counts, repeats):
+    """Print scan time per backend as the process count grows"""
+    backends = run.PROCESS_BACKENDS
+    print("Process table backends (median scan seconds)")
+    print(f"{'processes':>10} " + ' '.join(f"{name:>10}" for name in backends))
+    recorded = {}
+    for count in counts:
+        procs = spawn_idle_processes(count)
+        try:
+            results = {name: time_scan(backend(), repeats) for name, backend in backends.items()}
+            total = len(run.psutil.pids())
+            print(f"{total:>10} " + ' '.join(f"{results[name]:>10.4f}" for name in backends))
+            for name, seconds in results.items():
+                recorded[f'backends/+{count}p/{name}'] = seconds
+        finally:
+            stop_processes(procs)
+
+    ok = check_backend_parity(backends)
+    print("Backend parity: " + ("ok" if ok else "FAILED"))
+    return recorded, ok
+
+def _write_slice(root, uid, usage_usec, memory_bytes, io_lines):
+    path = os.path.join(root, 'user.slice', f'user-{uid}.slice')
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, 'cpu.stat'), 'w') as f:
+        f.write(f"usage_usec {usage_usec}\nuser_usec {usage_usec // 2}\nsystem_usec {usage_usec // 2}\n")
+    with open(os.path.join(path, 'memory.current'), 'w') as f:
+        f.write(f"{memory_bytes}\n")
+    with open(os.path.join(path, 'io.stat'), 'w') as f:
+        f.write(''.join(line + '\n' for line in io_lines))
+
+def check_cgroup_accounting(users, repeats):
+    """Check cgroup user totals against a fake cgroupfs tree and time a sample"""
+    ok = True
+    with tempfile.TemporaryDirectory() as root:
+        open(os.path.join(root, 'cgroup.controllers'), 'w').close()
+        uids = range(100000, 100000 + users)
+        for uid in uids:
+            _write_slice(root, uid, 1000000, 256 * run.MB, ['8:0 rbytes=0 wbytes=0 rios=0 wios=0'])
+        # Not a user slice; must be ignored
+        os.makedirs(os.path.join(root, 'user.slice', 'user-runtime-dir.slice'))
+        accounting = run.make_user_accounting('auto', root)
+        if not isinstance(accounting, run.CgroupUserAccounting):
+            print("  fake tree not detected as cgroup v2 with user slices")
+            return False
+        first = accounting.sample()
+        if len(first) != users or any(sample.cpu_percent for sample in first.values()):
+            print(f"  first sample: expected {users} idle users, got {len(first)}")
+            ok = False
+        
+        time.sleep(0.5)
+        uid = uids[0]
+        # 0.25s of CPU and 1 MB read / 2 MB written across two devices
+        _write_slice(root, uid, 1250000, 512 * run.MB,
+                     ['8:0 rbytes=524288 wbytes=1048576 rios=8 wios=16',
+                      '259:0 rbytes=524288 wbytes=1048576 rios=8 wios=16 dbytes=0 dios=0'])
+        sample = accounting.sample()[run.uid_username(uid)]
+        elapsed = 0.5
+        checks = [
+            ('cpu_percent', sample.cpu_percent, 0.25 / elapsed * 100),
+            ('io_read_rate', sample.io_read_rate, run.MB / elapsed),
+            ('io_write_rate', sample.io_write_rate, 2 * run.MB / elapsed)
+        ]
+        for name, actual, expected in checks:
+            # Allow for sleep overshoot
+            if not expected * 0.8 <= actual <= expected:
+                print(f"  {name}: {actual:.1f} not within 20% below {expected:.1f}")
+                ok = False
+        if sample.memory_bytes != 512 * run.MB:
+            print(f"  memory_bytes: {sample.memory_bytes} != {512 * run.MB}")
+            ok = False
+        
+        users_list = run.get_user_processes(run.ProcessTable(), {}, {sample.username: sample})
+        entry = next((user for user in users_list if user['username'] == sample.username), None)
+        if entry is None or entry['cpu_usage'] != sample.cpu_percent:
+            print("  cgroup totals were not applied to get_user_processes")
+            ok = False
+        
+        shutil.rmtree(os.path.join(root, 'user.slice', f'user-{uid}.slice'))
+        if run.uid_username(uid) in accounting.sample():
+            print("  removed slice still reported")
+            ok = False
+        
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            accounting.sample()
+            timings.append(time.perf_counter() - started)
+        print(f"cgroup accounting: {users} user slices sampled in {median(timings) * 1000:.2f} ms (median)")
+    return ok
+
+def bench_cgroup_accounting(users, repeats):
+    """Validate the cgroup backend on a fake tree and compare it with the process walk"""
+    ok = check_cgroup_accounting(users, repeats)
+    print("cgroup accounting on a fake tree: " + ("ok" if ok else "FAILED"))
+    table = run.process_table
+    time_scan(table, 1)
+    print(f"process walk for comparison: {len(table)} processes in {time_scan(table, repeats) * 1000:.2f} ms (median)")
+    if run.CgroupUserAccounting.available():
+        accounting = run.CgroupUserAccounting()
+        accounting.sample()
+        time.sleep(0.5)
+        totals = accounting.sample()
+        summed = {user['username']: user['cpu_usage'] for user in run.get_user_processes(table, {})}
+        for username, sample in sorted(totals.items()):
+            print(f"  {username:>12}: cgroup {sample.cpu_percent:6.1f}% cpu, "
+                  f"listed processes {summed.get(username, 0.0):6.1f}%")
+    return ok
+
+# Process names used by the synthetic workload
+SYNTHETIC_NAMES = ['python', 'bash', 'sleep', 'sshd', 'jupyter-lab', 'torchrun', 'pt_data_worker',
+                   'code-server', 'vim', 'htop', 'mpirun', 'R']
+
+class SyntheticProcessTable:
+    """Stand-in process table yielding a seeded synthetic workload instead of scanning the host
+
+    Processes are spread round-robin over `users` users in jobs of 1-16
+    processes sharing a process group. Each scan scales CPU and I/O by a
+    rotating factor so diffs between snapshots see realistic churn.
+    """
+
+    def __init__(self, processes, users, seed=0):
+        rng = random.Random(seed)
+        self._procs = []
+        pid = 1000
+        job = 0
+        while len(self._procs) < processes:
+            username = f'user{job % users:03d}'
+            size = min(rng.choice([1, 1, 1, 2, 4, 8, 16]), processes - len(self._procs))
+            root = pid
+            for i in range(size):
+                # A third of processes are busy; a few of those also write heavily
+                busy = rng.random() < 0.3
+                cpu_percent = rng.expovariate(1 / 20) if busy else rng.random()
+                rss = int(rng.lognormvariate(17, 1.5))
+                write_rate = rng.expovariate(1 / (4 * run.MB)) if busy and rng.random() < 0.2 else 0.0
+                ppid = 1 if i == 0 else root
+                self._procs.append((pid, username, rng.choice(SYNTHETIC_NAMES), cpu_percent, rss, write_rate,
+                                    ppid, root))
+                pid += 1
+            job += 1
+        self._factors = [0.5 + rng.random() for _ in range(997)]
+        self._scans = 0
+
+    def __len__(self):
+        return len(self._procs)
+
+    def gpu_backend(self, devices=8, share=0.05, seed=0):
+        """FakeGpuBackend with a share of the job leaders holding GPU memory"""
+        rng = random.Random(seed)
+        gpus = [run.GpuDevice(index, 'Synthetic GPU', rng.uniform(0, 100), 0, 81920, rng.randint(30, 85))
+                for index in range(devices)]
+        leaders = [proc[0] for proc in self._procs if proc[6] == 1]
+        holders = rng.sample(leaders, max(1, int(len(leaders) * share)))
+        processes = [run.GpuProcess(pid, rng.randrange(devices), rng.randint(512, 40960)) for pid in holders]
+        return run.FakeGpuBackend(gpus, processes)
+
+    def scan(self):
+        """Yield a ProcessSample for every synthetic process"""
+        factors = self._factors
+        offset = self._scans
+        self._scans += 1
+        sample = run.ProcessSample
+        for i, (pid, username, name, cpu_percent, rss, write_rate, ppid, pgid) in enumerate(self._procs):
+            factor = factors[(i + offset) % 997]
+            yield sample(pid, username, name, cpu_percent * factor, rss, write_rate * factor / 4,
+                         write_rate * factor, ppid, pgid)
+
+def use_synthetic_sources(processes, users):
+    """Point run.py's collectors at a synthetic process table and GPU set"""
+    table = SyntheticProcessTable(processes, users)
+    run.process_table = table
+    run.gpu_backend = table.gpu_backend()
+    run.user_accounting = None
+    return table
+
+def time_call(fn, repeats):
+    """Median seconds of `repeats` calls to fn()"""
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return median(timings)
+
+def bench_synthetic(process_counts, user_counts, repeats):
+    """Time the collection and serving hot paths against synthetic process tables"""
+    client = run.app.test_client()
+    top = run.parse_user_query({'top': ['3']})
+    stages = ['user_processes', 'collect', 'json', 'gzip', 'publish', 'delta', 'request', 'delta_request',
+              'view_top3', 'index']
+    print("Synthetic workloads (median ms)")
+    print(f"{'processes':>9} {'users':>5} " + ' '.join(f"{stage:>14}" for stage in stages))
+    results = {}
+    for processes in process_counts:
+        for users in user_counts:
+            table = use_synthetic_sources(processes, users)
+            gpu_processes = run.get_gpu_processes_nvidia(run.gpu_backend.sample())
+            # Warm up so per-process CPU deltas and the sampler history exist
+            run.sampler.sample_once()
+            data = run.collect_system_data()
+            payload = json.dumps(data)
+            timings = {
+                'user_processes': time_call(lambda: run.get_user_processes(table, gpu_processes), repeats),
+                'collect': time_call(run.collect_system_data, repeats),
+                'json': time_call(lambda: json.dumps(data), repeats),
+                'gzip': time_call(lambda: run.encode_body(payload, 'bench', True), repeats),
+                'publish': time_call(run.sampler.sample_once, repeats)
+            }
+            previous = run.sampler.current
+            snapshot = run.sampler.sample_once()
+            timings['delta'] = time_call(lambda: json.dumps(run.diff_snapshots(previous, snapshot)), repeats)
+            timings['request'] = time_call(lambda: client.get('/api/system-data'), repeats)
+
+            def first_delta_request():
+                # The first client after a publish pays for the diff and encode
+                run.sampler.sample_once()
+                started = time.perf_counter()
+                client.get(f'/api/system-data?since={run.sampler.current.seq - 1}')
+                return time.perf_counter() - started
+            timings['delta_request'] = median(first_delta_request() for _ in range(repeats))
+            timings['view_top3'] = time_call(lambda: run.select_users(data, top), repeats)
+            timings['index'] = time_call(lambda: client.get('/'), repeats)
+
+            print(f"{processes:>9} {users:>5} " + ' '.join(f"{timings[stage] * 1000:>14.2f}" for stage in stages))
+            for stage, seconds in timings.items():
+                results[f'synthetic/{processes}p/{users}u/{stage}'] = seconds
+    return results
+
+def serve_synthetic(processes, users, port, server):
+    """Serve the dashboard from synthetic sources, as a target for the http benchmark"""
+    use_synthetic_sources(processes, users)
+    print(f"Serving {processes} synthetic processes for {users} users on port {port} ({server})")
+    if server == 'asgi':
+        import uvicorn
+        uvicorn.run(run.asgi_app, host='127.0.0.1', port=port, log_level='warning',
+                    backlog=run.ASGI_BACKLOG, timeout_keep_alive=run.STREAM_KEEPALIVE)
+    else:
+        run.sampler.start()
+        run.app.run(host='127.0.0.1', port=port, threaded=True)
+
+def record_results(path, command, results):
+    """Append one run's results to a JSON lines file, tagged with the current commit"""
+    try:
+        commit = subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    entry = {
+        'commit': commit or 'unknown',
+        'time': time.time(),
+        'host': socket.gethostname(),
+        'python': platform.python_version(),
+        'command': command,
+        'results': results
+    }
+    with open(path, 'a') as f:
+        f.write(json.dumps(entry) + '\n')
+    print(f"Recorded {len(results)} results for {entry['commit']} in {path}")
+
+# Duration changes smaller than this are timer noise, whatever their percentage
+COMPARE_NOISE_FLOOR = 0.0005
+
+def compare_results(path, base=None, threshold=10.0):
+    """Compare the newest recorded run with the previous one (or the newest at commit `base`)
+
+    Returns the number of results that got slower by more than threshold percent.
+    """
+    with open(path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    if not runs:
+        print(f"No results recorded in {path}")
+        return 0
+    current = runs[-1]
+    candidates = [entry for entry in runs[:-1] if entry['command'] == current['command']]
+    if base is not None:
+        candidates = [entry for entry in candidates if entry['commit'].startswith(base)]
+    if not candidates:
+        print(f"No earlier '{current['command']}' run to compare {current['commit']} with")
+        return 0
+    previous = candidates[-1]
+
+    # Throughput grows when things improve; everything else is a duration
+    higher_is_better = lambda name: name.endswith('req_per_s')
+    print(f"{current['command']}: {previous['commit']} -> {current['commit']} (regression threshold {threshold:.0f}%)")
+    regressions = 0
+    for name in sorted(current['results'].keys() & previous['results'].keys()):
+        old, new = previous['results'][name], current['results'][name]
+        if not old:
+            continue
+        change = (new - old) / old * 100
+        worse = -change if higher_is_better(name) else change
+        flag = ''
+        if worse > threshold and (higher_is_better(name) or abs(new - old) > COMPARE_NOISE_FLOOR):
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f"  {name:<50} {old:>12.6g} {new:>12.6g} {change:>+8.1f}%{flag}")
+    print(f"{regressions} regression(s)")
+    return regressions
+
+async def _http_get(reader, writer, host, path):
+    """Issue one GET; return the body and whether the connection stays open"""
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    headers = await reader.readuntil(b'\r\n\r\n')
+    length = 0
+    keep_alive = True
+    for line in headers.lower().split(b'\r\n'):
+        if line.startswith(b'content-length:'):
+            length = int(line.split(b':', 1)[1])
+        elif line.startswith(b'connection:') and b'close' in line:
+            keep_alive = False
+    return await reader.readexactly(length), keep_alive
+
+async def _load_client(host, port, path, deadline, latencies):
+    connection = None
+    try:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            if connection is None:
+                connection = await asyncio.open_connection(host, port)
+            _, keep_alive = await _http_get(*connection, host, path)
+            latencies.append(time.perf_counter() - started)
+            if not keep_alive:
+                # The threaded development server closes after every response
+                connection[1].close()
+                connection = None
+    finally:
+        if connection is not None:
+            connection[1].close()
+
+async def _stream_client(host, port, received, ready):
+    """Hold one SSE connection open, recording when each event arrives"""
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET /api/stream HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    await reader.readuntil(b'\r\n\r\n')
+    ready.append(time.perf_counter())
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b'id: '):
+                # Ids are "<server instance>-<seq>"; the instance is the same for every viewer
+                seq = int(line[4:].rpartition(b'-')[2])
+                received.setdefault(seq, []).append(time.perf_counter())
+    finally:
+        writer.close()
+
+async def _bench_http(host, port, path, clients, streams, duration):
+    # Idle push connections first, so request latency is measured with them attached
+    received, ready = {}, []
+    started = time.perf_counter()
+    stream_tasks = [asyncio.ensure_future(_stream_client(host, port, received, ready)) for _ in range(streams)]
+    while len(ready) < streams and time.perf_counter() - started < 60:
+        await asyncio.sleep(0.05)
+    if streams:
+        print(f"  {len(ready)}/{streams} streams connected in {time.perf_counter() - started:.2f}s")
+
+    results = {}
+    latencies = []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(_load_client(host, port, path, deadline, latencies)
+                           for _ in range(clients)))
+    latencies.sort()
+    if latencies:
+        results = {
+            f'http{path}/{clients}c/req_per_s': len(latencies) / duration,
+            f'http{path}/{clients}c/p50': latencies[len(latencies) // 2],
+            f'http{path}/{clients}c/p99': latencies[int(len(latencies) * 0.99)]
+        }
+        print(f"  {clients} clients polling {path}: {len(latencies) / duration:.0f} req/s, "
+              f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+    # A viewer that stopped early (bad event, dropped connection) would quietly shrink the fan-out
+    ended = [task for task in stream_tasks if task.done()]
+    for task in stream_tasks:
+        task.cancel()
+    ok = not ended
+    if ended:
+        errors = [task.exception() for task in ended if not task.cancelled() and task.exception()]
+        print(f"  {len(ended)} stream viewers ended early" + (f", first error: {errors[0]!r}" if errors else ''))
+    # Fan-out: spread between the first and last viewer receiving the same event
+    complete = [times for times in received.values() if len(times) == len(ready)]
+    if complete:
+        spreads = sorted(max(times) - min(times) for times in complete)
+        print(f"  stream fan-out to {len(ready)} viewers: median spread {median(spreads) * 1000:.1f} ms "
+              f"over {len(complete)} events")
+        results[f'http/stream/{len(ready)}v/fanout_spread'] = median(spreads)
+    elif ready:
+        print(f"  no event reached all {len(ready)} stream viewers")
+    return results, ok
+
+def bench_http(url, paths, clients, streams, duration):
+    """Load-test a running server with polling clients and idle stream viewers
+    
+    Returns (results, ok); ok is False when any stream viewer ended early.
+    """
+    parsed = urlsplit(url)
+    results = {}
+    ok = True
+    for path in paths:
+        print(f"HTTP load against {url}{path} for {duration}s")
+        path_results, path_ok = asyncio.run(_bench_http(parsed.hostname, parsed.port or 80, path, clients,
+                                                        streams, duration))
+        results.update(path_results)
+        ok = ok and path_ok
+    return results, ok
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--record', metavar='PATH',
+                        help='append results to this JSON lines file, tagged with the current commit')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    backends = commands.add_parser('backends', help='process table scan time and parity')
+    backends.add_argument('--counts', type=int, nargs='+', default=[0, 500, 2000],
+                          help='extra idle processes to spawn for each run')
+    backends.add_argument('--repeats', type=int, default=5,
+                          help='scans timed per backend and process count')
+
+    cgroup = commands.add_parser('cgroup', help='cgroup user accounting against a fake cgroupfs tree')
+    cgroup.add_argument('--users', type=int, default=200,
+                        help='user slices in the fake tree')
+    cgroup.add_argument('--repeats', type=int, default=5)
+
+    http = commands.add_parser('http', help='load-test a running server (run.py --server flask|asgi)')
+    http.add_argument('--url', default='http://127.0.0.1:5000')
+    http.add_argument('--path', nargs='+', default=['/api/system-data'],
+                      help='endpoints to poll, one run each')
+    http.add_argument('--clients', type=int, default=50,
+                      help='concurrent clients polling each path')
+    http.add_argument('--streams', type=int, default=1000,
+                      help='idle /api/stream viewers held open during the run')
+    http.add_argument('--duration', type=float, default=10.0)
+
+    synthetic = commands.add_parser('synthetic', help='collection and serving against synthetic process tables')
+    synthetic.add_argument('--processes', type=int, nargs='+', default=[1000, 10000, 50000])
+    synthetic.add_argument('--users', type=int, nargs='+', default=[10, 100, 500])
+    synthetic.add_argument('--repeats', type=int, default=5)
+
+    serve = commands.add_parser('serve', help='serve the dashboard from synthetic sources for the http benchmark')
+    serve.add_argument('--processes', type=int, default=10000)
+    serve.add_argument('--users', type=int, default=100)
+    serve.add_argument('--port', type=int, default=5001)
+    serve.add_argument('--server', choices=['flask', 'asgi'], default='asgi')
+
+    compare = commands.add_parser('compare', help='compare the newest recorded run with an earlier one')
+    compare.add_argument('path', help='JSON lines file written by --record')
+    compare.add_argument('--base', help='compare against the newest run at this commit instead of the previous run')
+    compare.add_argument('--threshold', type=float, default=10.0,
+                         help='percent slowdown reported as a regression')
+    args = parser.parse_args()
+
+    # Checks that fail make the exit status non-zero, so CI can run them
+    results = None
+    ok = True
+    if args.command == 'backends':
+        results, ok = bench_process_backends(args.counts, args.repeats)
+        command = f"backends --counts {' '.join(map(str, args.counts))}"
+    elif args.command == 'cgroup':
+        ok = bench_cgroup_accounting(args.users, args.repeats)
+    elif args.command == 'http':
+        results, ok = bench_http(args.url, args.path, args.clients, args.streams, args.duration)
+        command = f"http --path {' '.join(args.path)} --clients {args.clients} --streams {args.streams}"
+    elif args.command == 'synthetic':
+        results = bench_synthetic(args.processes, args.users, args.repeats)
+        command = (f"synthetic --processes {' '.join(map(str, args.processes))} "
+                   f"--users {' '.join(map(str, args.users))}")
+    elif args.command == 'serve':
+        serve_synthetic(args.processes, args.users, args.port, args.server)
+    elif args.command == 'compare':
+        raise SystemExit(1 if compare_results(args.path, args.base, args.threshold) else 0)
+
+    if args.record and results:
+        record_results(args.record, command, results)
+    if not ok:
+        raise SystemExit(1)
@@ -8,551 +8,194 @@ import json
 import time
 import psutil
 import threading
+import argparse
+import os
+import io
+import sys
+import mmap
+import struct
+import asyncio
+import socket
+import hashlib
+import hmac
+import mimetypes
+import zlib
+import gzip
+import random
+import heapq
+import math
+import csv
+import atexit
+import http.client
+from urllib.parse import urlsplit, parse_qs
+import pwd
 from datetime import datetime, timedelta
-from flask import Flask, render_template_string, jsonify
-from collections import defaultdict
-import GPUtil
+from flask import Flask, Response, request, render_template, jsonify, stream_with_context
+from collections import defaultdict, namedtuple, deque
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left, bisect_right
+import shutil
 import subprocess
 import re
 
-app = Flask(__name__)
-
-# Store the HTML template
-HTML_TEMPLATE = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Multi-User System Monitor</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-            color: white;
-            min-height: 100vh;
-            padding: 20px;
-        }
-        
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-        }
-        
-        .header {
-            text-align: center;
-            margin-bottom: 30px;
-        }
-        
-        .header h1 {
-            font-size: 2.5em;
-            margin-bottom: 10px;
-            text-shadow: 2px 2px 4px rgba(0,0,0,0.3);
-        }
-        
-        .status-indicator {
-            display: inline-block;
-            width: 12px;
-            height: 12px;
-            border-radius: 50%;
-            background-color: #4CAF50;
-            margin-left: 10px;
-            animation: pulse 2s infinite;
-        }
-        
-        @keyframes pulse {
-            0% { opacity: 1; }
-            50% { opacity: 0.5; }
-            100% { opacity: 1; }
-        }
-        
-        .metrics-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(400px, 1fr));
-            gap: 20px;
-            margin-bottom: 30px;
-        }
-        
-        .metric-card {
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            border-radius: 15px;
-            padding: 25px;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-            transition: transform 0.3s ease;
-        }
-        
-        .metric-card:hover {
-            transform: translateY(-5px);
-        }
-        
-        .metric-title {
-            font-size: 1.3em;
-            margin-bottom: 20px;
-            text-align: center;
-            font-weight: bold;
-        }
-        
-        .usage-bar {
-            width: 100%;
-            height: 30px;
-            background-color: rgba(255, 255, 255, 0.2);
-            border-radius: 15px;
-            overflow: hidden;
-            margin-bottom: 10px;
-            position: relative;
-        }
-        
-        .usage-fill {
-            height: 100%;
-            border-radius: 15px;
-            transition: width 0.5s ease;
-            background: linear-gradient(90deg, #4CAF50 0%, #FFC107 70%, #F44336 100%);
-        }
-        
-        .usage-text {
-            position: absolute;
-            top: 50%;
-            left: 50%;
-            transform: translate(-50%, -50%);
-            font-weight: bold;
-            text-shadow: 1px 1px 2px rgba(0,0,0,0.7);
-        }
-        
-        .chart-container {
-            height: 200px;
-            margin-top: 20px;
-            position: relative;
-        }
-        
-        .chart {
-            width: 100%;
-            height: 100%;
-        }
-        
-        .users-section {
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            border-radius: 15px;
-            padding: 25px;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-            margin-bottom: 20px;
-        }
-        
-        .section-title {
-            font-size: 1.4em;
-            margin-bottom: 20px;
-            text-align: center;
-            font-weight: bold;
-        }
-        
-        .users-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-            gap: 15px;
-            margin-bottom: 20px;
-        }
-        
-        .user-card {
-            background: rgba(255, 255, 255, 0.05);
-            border-radius: 10px;
-            padding: 15px;
-            border: 1px solid rgba(255, 255, 255, 0.1);
-        }
-        
-        .user-header {
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-            margin-bottom: 15px;
-        }
-        
-        .user-name {
-            font-size: 1.1em;
-            font-weight: bold;
-        }
-        
-        .user-status {
-            font-size: 0.9em;
-            padding: 3px 8px;
-            border-radius: 10px;
-            background-color: rgba(76, 175, 80, 0.3);
-        }
-        
-        .user-inactive {
-            background-color: rgba(158, 158, 158, 0.3);
-        }
-        
-        .user-metrics {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 10px;
-        }
-        
-        .user-metric {
-            text-align: center;
-        }
-        
-        .user-metric-label {
-            font-size: 0.8em;
-            opacity: 0.8;
-            margin-bottom: 5px;
-        }
-        
-        .user-metric-value {
-            font-size: 1.1em;
-            font-weight: bold;
-        }
-        
-        .process-list {
-            margin-top: 15px;
-            max-height: 120px;
-            overflow-y: auto;
-        }
-        
-        .process-item {
-            background: rgba(255, 255, 255, 0.05);
-            margin-bottom: 5px;
-            padding: 8px;
-            border-radius: 5px;
-            font-size: 0.85em;
-        }
-        
-        .process-name {
-            font-weight: bold;
-            margin-bottom: 2px;
-        }
-        
-        .process-stats {
-            opacity: 0.8;
-        }
-        
-        .info-section {
-            background: rgba(255, 255, 255, 0.1);
-            backdrop-filter: blur(10px);
-            border-radius: 15px;
-            padding: 25px;
-            border: 1px solid rgba(255, 255, 255, 0.2);
-        }
-        
-        .info-grid {
-            display: grid;
-            grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-            gap: 20px;
-        }
-        
-        .info-item {
-            text-align: center;
-        }
-        
-        .info-label {
-            font-size: 0.9em;
-            opacity: 0.8;
-            margin-bottom: 5px;
-        }
-        
-        .info-value {
-            font-size: 1.2em;
-            font-weight: bold;
-        }
-        
-        .last-updated {
-            text-align: center;
-            margin-top: 20px;
-            opacity: 0.7;
-            font-size: 0.9em;
-        }
-        
-        .scrollable {
-            max-height: 400px;
-            overflow-y: auto;
-        }
-        
-        .scrollable::-webkit-scrollbar {
-            width: 8px;
-        }
-        
-        .scrollable::-webkit-scrollbar-track {
-            background: rgba(255, 255, 255, 0.1);
-            border-radius: 4px;
-        }
-        
-        .scrollable::-webkit-scrollbar-thumb {
-            background: rgba(255, 255, 255, 0.3);
-            border-radius: 4px;
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>{{ hostname }} Multi-User Monitor <span class="status-indicator"></span></h1>
-            <p>Real-time CPU and GPU monitoring by user</p>
-        </div>
-        
-        <div class="metrics-grid">
-            <div class="metric-card">
-                <div class="metric-title">Total CPU Usage</div>
-                <div class="usage-bar">
-                    <div class="usage-fill" id="cpu-fill"></div>
-                    <div class="usage-text" id="cpu-text">0%</div>
-                </div>
-                <canvas class="chart" id="cpu-chart"></canvas>
-            </div>
-            
-            <div class="metric-card">
-                <div class="metric-title">Total GPU Usage</div>
-                <div class="usage-bar">
-                    <div class="usage-fill" id="gpu-fill"></div>
-                    <div class="usage-text" id="gpu-text">0%</div>
-                </div>
-                <canvas class="chart" id="gpu-chart"></canvas>
-            </div>
-        </div>
-        
-        <div class="users-section">
-            <div class="section-title">User Activity</div>
-            <div class="users-grid scrollable" id="users-grid">
-                <!-- User cards will be populated here -->
-            </div>
-        </div>
-        
-        <div class="info-section">
-            <div class="info-grid">
-                <div class="info-item">
-                    <div class="info-label">CPU Temperature</div>
-                    <div class="info-value" id="cpu-temp">--°C</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">GPU Temperature</div>
-                    <div class="info-value" id="gpu-temp">--°C</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">RAM Usage</div>
-                    <div class="info-value" id="ram-usage">-- GB</div>
-                </div>
-                <div class="info-item">
-                    <div class="info-label">Active Users</div>
-                    <div class="info-value" id="active-users">--</div>
-                </div>
-            </div>
-            <div class="last-updated" id="last-updated">
-                Last updated: Never
-            </div>
-        </div>
-    </div>
-
-    <script>
-        class SystemMonitor {
-            constructor() {
-                this.cpuHistory = [];
-                this.gpuHistory = [];
-                this.maxHistoryPoints = 60;
-                
-                this.initCharts();
-                this.startMonitoring();
-            }
-            
-            initCharts() {
-                this.cpuChart = document.getElementById('cpu-chart');
-                this.cpuCtx = this.cpuChart.getContext('2d');
-                this.cpuChart.width = this.cpuChart.offsetWidth;
-                this.cpuChart.height = this.cpuChart.offsetHeight;
-                
-                this.gpuChart = document.getElementById('gpu-chart');
-                this.gpuCtx = this.gpuChart.getContext('2d');
-                this.gpuChart.width = this.gpuChart.offsetWidth;
-                this.gpuChart.height = this.gpuChart.offsetHeight;
-            }
-            
-            async fetchSystemData() {
-                try {
-                    const response = await fetch('/api/system-data');
-                    return await response.json();
-                } catch (error) {
-                    console.error('Failed to fetch system data:', error);
-                    return null;
-                }
-            }
-            
-            updateUI(data) {
-                if (!data) return;
-                
-                // Update total CPU
-                const cpuFill = document.getElementById('cpu-fill');
-                const cpuText = document.getElementById('cpu-text');
-                cpuFill.style.width = `${data.cpu.usage}%`;
-                cpuText.textContent = `${Math.round(data.cpu.usage)}%`;
-                
-                // Update total GPU
-                const gpuFill = document.getElementById('gpu-fill');
-                const gpuText = document.getElementById('gpu-text');
-                gpuFill.style.width = `${data.gpu.usage}%`;
-                gpuText.textContent = `${Math.round(data.gpu.usage)}%`;
-                
-                // Update users
-                this.updateUsersGrid(data.users);
-                
-                // Update additional info
-                document.getElementById('cpu-temp').textContent = data.cpu.temperature;
-                document.getElementById('gpu-temp').textContent = data.gpu.temperature;
-                document.getElementById('ram-usage').textContent = data.memory.display;
-                document.getElementById('active-users').textContent = data.active_user_count;
-                
-                // Update timestamp
-                document.getElementById('last-updated').textContent = `Last updated: ${new Date().toLocaleTimeString()}`;
-                
-                // Update history
-                this.cpuHistory.push(data.cpu.usage);
-                this.gpuHistory.push(data.gpu.usage);
-                
-                if (this.cpuHistory.length > this.maxHistoryPoints) {
-                    this.cpuHistory.shift();
-                    this.gpuHistory.shift();
-                }
-                
-                this.drawCharts();
-            }
-            
-            updateUsersGrid(users) {
-                const grid = document.getElementById('users-grid');
-                grid.innerHTML = '';
-                
-                users.forEach(user => {
-                    const userCard = document.createElement('div');
-                    userCard.className = 'user-card';
-                    
-                    const isActive = user.cpu_usage > 5 || user.processes.length > 0;
-                    const statusClass = isActive ? '' : 'user-inactive';
-                    const statusText = isActive ? 'Active' : 'Idle';
-                    
-                    let processesHtml = '';
-                    if (user.processes.length > 0) {
-                        processesHtml = `
-                            <div class="process-list">
-                                ${user.processes.slice(0, 3).map(proc => `
-                                    <div class="process-item">
-                                        <div class="process-name">${proc.name}</div>
-                                        <div class="process-stats">CPU: ${proc.cpu_percent}% | RAM: ${proc.memory_mb}MB</div>
-                                    </div>
-                                `).join('')}
-                                ${user.processes.length > 3 ? `<div class="process-item" style="text-align: center; opacity: 0.6;">+${user.processes.length - 3} more processes...</div>` : ''}
-                            </div>
-                        `;
-                    }
-                    
-                    userCard.innerHTML = `
-                        <div class="user-header">
-                            <div class="user-name">${user.username}</div>
-                            <div class="user-status ${statusClass}">${statusText}</div>
-                        </div>
-                        <div class="user-metrics">
-                            <div class="user-metric">
-                                <div class="user-metric-label">CPU Usage</div>
-                                <div class="user-metric-value">${user.cpu_usage.toFixed(1)}%</div>
-                            </div>
-                            <div class="user-metric">
-                                <div class="user-metric-label">RAM Usage</div>
-                                <div class="user-metric-value">${user.memory_usage.toFixed(1)}%</div>
-                            </div>
-                        </div>
-                        ${processesHtml}
-                    `;
-                    
-                    grid.appendChild(userCard);
-                });
-                
-                if (users.length === 0) {
-                    grid.innerHTML = '<div style="text-align: center; opacity: 0.6; padding: 20px;">No active users detected</div>';
-                }
-            }
-            
-            drawCharts() {
-                this.drawChart(this.cpuCtx, this.cpuHistory, '#4CAF50');
-                this.drawChart(this.gpuCtx, this.gpuHistory, '#FF9800');
-            }
-            
-            drawChart(ctx, data, color) {
-                const canvas = ctx.canvas;
-                ctx.clearRect(0, 0, canvas.width, canvas.height);
-                
-                if (data.length < 2) return;
-                
-                const padding = 20;
-                const width = canvas.width - padding * 2;
-                const height = canvas.height - padding * 2;
-                
-                // Draw grid
-                ctx.strokeStyle = 'rgba(255, 255, 255, 0.1)';
-                ctx.lineWidth = 1;
-                
-                for (let i = 0; i <= 4; i++) {
-                    const y = padding + (height / 4) * i;
-                    ctx.beginPath();
-                    ctx.moveTo(padding, y);
-                    ctx.lineTo(canvas.width - padding, y);
-                    ctx.stroke();
-                }
-                
-                // Draw data line
-                ctx.strokeStyle = color;
-                ctx.lineWidth = 2;
-                ctx.beginPath();
-                
-                for (let i = 0; i < data.length; i++) {
-                    const x = padding + (width / (data.length - 1)) * i;
-                    const y = padding + height - (data[i] / 100) * height;
-                    
-                    if (i === 0) {
-                        ctx.moveTo(x, y);
-                    } else {
-                        ctx.lineTo(x, y);
-                    }
-                }
-                
-                ctx.stroke();
-                
-                // Fill area under curve
-                ctx.lineTo(canvas.width - padding, canvas.height - padding);
-                ctx.lineTo(padding, canvas.height - padding);
-                ctx.closePath();
-                
-                const gradient = ctx.createLinearGradient(0, padding, 0, canvas.height - padding);
-                gradient.addColorStop(0, color + '40');
-                gradient.addColorStop(1, color + '10');
-                
-                ctx.fillStyle = gradient;
-                ctx.fill();
-            }
-            
-            startMonitoring() {
-                const updateData = async () => {
-                    const data = await this.fetchSystemData();
-                    this.updateUI(data);
-                };
-                
-                updateData();
-                setInterval(updateData, 3000); // Update every 3 seconds for user data
-            }
-        }
-        
-        window.addEventListener('load', () => {
-            new SystemMonitor();
-        });
-        
-        window.addEventListener('resize', () => {
-            const monitor = new SystemMonitor();
-        });
-    </script>
-</body>
-</html>
-"""
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+# Assets are served under content-hashed names by static_asset()
+app = Flask(__name__, static_folder=None)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HOSTNAME = socket.gethostname()
+
+# A process is listed when it uses more CPU (%) or RSS (MB) than these, or any GPU memory,
+PROCESS_MIN_CPU = 1.0
+PROCESS_MIN_MEMORY_MB = 50.0
+# ...or does more disk I/O than this many bytes per second
+PROCESS_MIN_IO_RATE = 1024 * 1024
+# Seconds between host-level samples (CPU, memory, uptime)
+DEFAULT_SAMPLE_INTERVAL = 1.0
+# Seconds between process and GPU scans; stretched up to SCAN_INTERVAL_MAX to stay in the CPU budget
+DEFAULT_SCAN_INTERVAL = 2.0
+SCAN_INTERVAL_MAX = 60.0
+# Monitor CPU time allowed per wall-clock second (0.05 = 5% of one core), measured over BUDGET_WINDOW seconds
+DEFAULT_CPU_BUDGET = 0.05
+BUDGET_WINDOW = 10.0
+# Sampling slows to IDLE_SAMPLE_INTERVAL once nobody has streamed or polled for VIEWER_IDLE_SECONDS
+IDLE_SAMPLE_INTERVAL = 10.0
+VIEWER_IDLE_SECONDS = 30.0
+# How long a request waits for the very first snapshot
+SNAPSHOT_WAIT_TIMEOUT = 10.0
+# Snapshots retained for answering ?since= delta requests
+DELTA_HISTORY = 30
+# cgroup v2 mount read by the cgroup user accounting
+CGROUP_ROOT = '/sys/fs/cgroup'
+# Bytes per megabyte, as reported for GPU memory
+MB = 1024 * 1024
+# Buffer size for reading /proc/[pid] files in the procfs backend
+PROCFS_READ_SIZE = 4096
+# Rows kept per series in the in-memory history (1 hour at the default interval)
+HISTORY_CAPACITY = 3600
+# (bucket seconds, buckets kept) for history rollups: 1 day of minutes, 30 days of 10 minutes
+ROLLUP_TIERS = ((60, 1440), (600, 4320))
+# Users given their own history series; one that fills every tier holds about 0.7 MB,
+# so per-user history stays under about 90 MB however many users log in
+HISTORY_MAX_USERS = 128
+# On-disk archive: one segment file per day, kept for 30 days
+ARCHIVE_SEGMENT_SECONDS = 86400
+ARCHIVE_RETENTION = 30 * 86400
+# Rows per series an archive query returns when no resolution is given
+ARCHIVE_MAX_POINTS = 2000
+# Agent push settings
+AGENT_TIMEOUT = 10.0
+AGENT_MIN_BACKOFF = 1.0
+AGENT_MAX_BACKOFF = 60.0
+AGENT_COMPRESSION_LEVEL = 6
+# Seconds without a push before an agent's host is left out of cluster totals
+CLUSTER_STALE_SECONDS = 30.0
+# Seconds without a push before an agent's host is forgotten altogether
+CLUSTER_FORGET_SECONDS = 3600.0
+# Listen backlog for the asgi server, sized for bursts of dashboard connections
+ASGI_BACKLOG = 4096
+# Pre-compression of cached JSON responses
+GZIP_LEVEL = 6
+GZIP_MIN_SIZE = 512
+# Hashed asset URLs never change content, so browsers may keep them for a year
+ASSET_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Seconds between keepalive comments on an idle event stream
+STREAM_KEEPALIVE = 15.0
+# Usage accounting: hourly buckets kept for 90 days; gaps longer than USAGE_MAX_GAP are not billed
+USAGE_BUCKET_SECONDS = 3600
+USAGE_RETENTION = 90 * 86400
+USAGE_MAX_GAP = 120.0
+# Seconds between saves of the open usage bucket, the most usage a restart can lose
+USAGE_CHECKPOINT_SECONDS = 60.0
+# Look-back of each /api/usage-report period
+USAGE_PERIODS = {'day': 86400, 'week': 7 * 86400, 'month': 30 * 86400}
+# Latest epoch time accepted as a report bound (the year 3000), well within datetime's range
+USAGE_MAX_TIMESTAMP = 32503680000
+# Alert events kept in snapshots for the dashboard, and queued for a slow webhook
+ALERT_RECENT_EVENTS = 20
+ALERT_WEBHOOK_QUEUE = 100
+# Upper bounds (seconds) of the /metrics stage latency histogram buckets
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class SelfMetrics:
+    """Stage latencies, error and request counts for the monitor's own work"""
+    
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # stage -> [per-bucket counts, count, sum]
+        self._latency = {}
+        self._errors = defaultdict(int)
+        self._requests = defaultdict(int)
+    
+    def observe(self, stage, seconds):
+        """Record one run of a stage"""
+        with self._lock:
+            entry = self._latency.get(stage)
+            if entry is None:
+                entry = self._latency[stage] = [[0] * len(self.buckets), 0, 0.0]
+            index = bisect_left(self.buckets, seconds)
+            if index < len(self.buckets):
+                entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += seconds
+    
+    @contextmanager
+    def timed(self, stage):
+        """Time the enclosed block as one run of stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+    
+    def error(self, collector, message):
+        """Count a failure in collector and report it"""
+        with self._lock:
+            self._errors[collector] += 1
+        print(message)
+    
+    def request(self, route, method, status):
+        """Count one HTTP response"""
+        with self._lock:
+            self._requests[(route, method, status)] += 1
+    
+    def render(self):
+        """Exposition lines for everything recorded so far"""
+        with self._lock:
+            latency = {stage: (list(counts), count, total) for stage, (counts, count, total) in self._latency.items()}
+            errors = dict(self._errors)
+            requests = dict(self._requests)
+        lines = ['# HELP system_monitor_stage_seconds Time spent in each collection and encoding stage',
+                 '# TYPE system_monitor_stage_seconds histogram']
+        for stage, (counts, count, total) in sorted(latency.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'system_monitor_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'system_monitor_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'system_monitor_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'system_monitor_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines += ['# HELP system_monitor_collector_errors_total Failures per collector',
+                  '# TYPE system_monitor_collector_errors_total counter']
+        lines += [f'system_monitor_collector_errors_total{{collector="{collector}"}} {count}'
+                  for collector, count in sorted(errors.items())]
+        lines += ['# HELP system_monitor_http_requests_total HTTP responses by route, method and status',
+                  '# TYPE system_monitor_http_requests_total counter']
+        lines += [f'system_monitor_http_requests_total{{route="{_metric_label(route)}",method="{method}",'
+                  f'status="{status}"}} {count}' for (route, method, status), count in sorted(requests.items())]
+        return lines
+
+def _metric_label(value):
+    """Escape a label value for the text exposition format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+self_metrics = SelfMetrics()
 
 def get_cpu_temperature():
     """Get CPU temperature if available"""
@@ -564,91 +207,663 @@ def get_cpu_temperature():
             return f"{temps['cpu_thermal'][0].current:.1f}°C"
         else:
             return "N/A"
-    except:
+    except AttributeError:
+        # psutil has no sensor support on this platform
+        return "N/A"
+    except OSError as e:
+        self_metrics.error('cpu_temperature', f"Error reading CPU temperature: {e}")
         return "N/A"
 
-def get_gpu_info():
-    """Get GPU usage and temperature"""
+# One GPU query: per-device metrics plus per-PID memory use
+GpuSample = namedtuple('GpuSample', ['devices', 'processes'])
+GpuDevice = namedtuple('GpuDevice', ['index', 'name', 'utilization', 'memory_used', 'memory_total', 'temperature'])
+# utilization is the process's SM share of its device, when the backend reports it
+GpuProcess = namedtuple('GpuProcess', ['pid', 'device', 'gpu_memory', 'utilization'], defaults=[None])
+
+EMPTY_GPU_SAMPLE = GpuSample((), ())
+
+class NvmlGpuBackend:
+    """GPU backend holding NVML device handles for the life of the process"""
+    
+    def __init__(self):
+        if pynvml is None:
+            raise RuntimeError("pynvml (nvidia-ml-py) is not installed")
+        pynvml.nvmlInit()
+        self._devices = []
+        # Per-device timestamp of the newest process utilisation sample seen
+        self._last_seen = {}
+        for index in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(index)
+            name = pynvml.nvmlDeviceGetName(handle)
+            if isinstance(name, bytes):
+                name = name.decode()
+            self._devices.append((index, name, handle))
+    
+    def _process_utilization(self, index, handle):
+        """Map pid to SM utilisation from samples newer than the last query"""
+        try:
+            samples = pynvml.nvmlDeviceGetProcessUtilization(handle, self._last_seen.get(index, 0))
+        except pynvml.NVMLError:
+            # No samples since the last query, or not supported on this device
+            return {}
+        usage = {}
+        for sample in samples:
+            usage[sample.pid] = max(usage.get(sample.pid, 0), sample.smUtil)
+            self._last_seen[index] = max(self._last_seen.get(index, 0), sample.timeStamp)
+        return usage
+    
+    def sample(self):
+        """Query every device in-process"""
+        devices, processes = [], []
+        for index, name, handle in self._devices:
+            try:
+                utilization = pynvml.nvmlDeviceGetUtilizationRates(handle).gpu
+                memory = pynvml.nvmlDeviceGetMemoryInfo(handle)
+                running = pynvml.nvmlDeviceGetComputeRunningProcesses(handle)
+            except pynvml.NVMLError as e:
+                self_metrics.error('gpu_nvml', f"Error querying GPU {index}: {e}")
+                continue
+            try:
+                temperature = pynvml.nvmlDeviceGetTemperature(handle, pynvml.NVML_TEMPERATURE_GPU)
+            except pynvml.NVMLError:
+                temperature = None
+            devices.append(GpuDevice(index, name, float(utilization), memory.used // MB,
+                                     memory.total // MB, temperature))
+            usage = self._process_utilization(index, handle)
+            for proc in running:
+                used = proc.usedGpuMemory or 0
+                processes.append(GpuProcess(proc.pid, index, used // MB, usage.get(proc.pid)))
+        return GpuSample(tuple(devices), tuple(processes))
+
+class SmiGpuBackend:
+    """GPU backend parsing nvidia-smi CSV output, for hosts without NVML bindings"""
+    
+    def __init__(self, command='nvidia-smi'):
+        self.command = shutil.which(command)
+    
+    def _query(self, query):
+        result = subprocess.run([self.command, query, '--format=csv,noheader,nounits'],
+                                capture_output=True, text=True, timeout=5)
+        if result.returncode != 0:
+            return []
+        return [line.split(', ') for line in result.stdout.strip().split('\n') if line.strip()]
+    
+    def sample(self):
+        """Query devices and compute apps with nvidia-smi"""
+        if self.command is None:
+            return EMPTY_GPU_SAMPLE
+        try:
+            devices, by_uuid = [], {}
+            fields = 'index,name,utilization.gpu,memory.used,memory.total,temperature.gpu,uuid'
+            for parts in self._query(f'--query-gpu={fields}'):
+                if len(parts) < 7:
+                    continue
+                index = int(parts[0])
+                by_uuid[parts[6]] = index
+                temperature = int(parts[5]) if parts[5].isdigit() else None
+                devices.append(GpuDevice(index, parts[1], _smi_number(parts[2]), int(_smi_number(parts[3])),
+                                         int(_smi_number(parts[4])), temperature))
+            processes = []
+            for parts in self._query('--query-compute-apps=gpu_uuid,pid,used_memory'):
+                if len(parts) >= 3:
+                    memory = int(parts[2]) if parts[2].isdigit() else 0
+                    processes.append(GpuProcess(int(parts[1]), by_uuid.get(parts[0], 0), memory))
+            return GpuSample(tuple(devices), tuple(processes))
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            self_metrics.error('gpu_smi', f"Error running nvidia-smi: {e}")
+            return EMPTY_GPU_SAMPLE
+
+def _smi_number(text):
+    """Parse a numeric nvidia-smi field, which may read [N/A]"""
     try:
-        gpus = GPUtil.getGPUs()
-        if gpus:
-            gpu = gpus[0]  # Use first GPU
-            return {
-                'usage': gpu.load * 100,
-                'temperature': f"{gpu.temperature}°C" if gpu.temperature else "N/A"
-            }
-        else:
-            return {'usage': 0, 'temperature': "N/A"}
-    except:
-        return {'usage': 0, 'temperature': "N/A"}
+        return float(text)
+    except ValueError:
+        return 0.0
+
+class FakeGpuBackend:
+    """GPU backend returning fixed data, for GPU-less machines and tests"""
+    
+    def __init__(self, devices=None, processes=()):
+        if devices is None:
+            devices = [GpuDevice(0, 'Fake GPU', 0.0, 0, 16384, None)]
+        self.devices = tuple(devices)
+        self.processes = tuple(processes)
+    
+    def sample(self):
+        """Return the configured devices and processes"""
+        return GpuSample(self.devices, self.processes)
 
-def get_gpu_processes_nvidia():
-    """Get GPU processes using nvidia-smi"""
+# GPU backends selectable with --gpu-backend
+GPU_BACKENDS = {
+    'nvml': NvmlGpuBackend,
+    'smi': SmiGpuBackend,
+    'fake': FakeGpuBackend
+}
+
+def make_gpu_backend(name='auto'):
+    """Create a GPU backend; 'auto' prefers NVML and falls back to nvidia-smi"""
+    if name != 'auto':
+        return GPU_BACKENDS[name]()
     try:
-        result = subprocess.run(['nvidia-smi', '--query-compute-apps=pid,process_name,used_memory', 
-                               '--format=csv,noheader,nounits'], 
-                               capture_output=True, text=True, timeout=5)
+        return NvmlGpuBackend()
+    except Exception:
+        return SmiGpuBackend()
+
+gpu_backend = make_gpu_backend()
+
+def get_gpu_info(sample=None):
+    """Get overall and per-device GPU usage and temperature"""
+    if sample is None:
+        sample = gpu_backend.sample()
+    devices = [{
+        'index': gpu.index,
+        'name': gpu.name,
+        'usage': gpu.utilization,
+        'memory_used': gpu.memory_used,
+        'memory_total': gpu.memory_total,
+        'temperature': f"{gpu.temperature}°C" if gpu.temperature is not None else "N/A"
+    } for gpu in sample.devices]
+    if devices:
+        temperatures = [gpu.temperature for gpu in sample.devices if gpu.temperature is not None]
+        return {
+            'usage': sum(gpu.utilization for gpu in sample.devices) / len(devices),
+            # The hottest device is the one worth flagging
+            'temperature': f"{max(temperatures)}°C" if temperatures else "N/A",
+            'memory_used': sum(gpu.memory_used for gpu in sample.devices),
+            'memory_total': sum(gpu.memory_total for gpu in sample.devices),
+            'devices': devices
+        }
+    else:
+        return {'usage': 0, 'temperature': "N/A", 'memory_used': 0, 'memory_total': 0, 'devices': []}
+
+def get_gpu_processes_nvidia(sample=None):
+    """Get GPU memory and utilisation per process, summed across devices"""
+    if sample is None:
+        sample = gpu_backend.sample()
+    utilization = {gpu.index: gpu.utilization for gpu in sample.devices}
+    device_memory = defaultdict(int)
+    for proc in sample.processes:
+        device_memory[proc.device] += proc.gpu_memory
+    
+    gpu_processes = {}
+    for proc in sample.processes:
+        if proc.utilization is not None:
+            usage = proc.utilization
+        elif device_memory[proc.device]:
+            # No per-process figure: share the device's load by memory held
+            usage = utilization.get(proc.device, 0.0) * proc.gpu_memory / device_memory[proc.device]
+        else:
+            usage = 0.0
+        entry = gpu_processes.setdefault(proc.pid, {'gpu_memory': 0, 'gpu_usage': 0.0, 'devices': []})
+        entry['gpu_memory'] += proc.gpu_memory
+        entry['gpu_usage'] += usage
+        entry['devices'].append(proc.device)
+    return gpu_processes
+
+# Per-process values reported by a process table scan; I/O rates are storage bytes per second
+ProcessSample = namedtuple('ProcessSample', ['pid', 'username', 'name', 'cpu_percent', 'rss',
+                                             'read_rate', 'write_rate', 'ppid', 'pgid'],
+                           defaults=[0.0, 0.0, 0, 0])
+
+def _io_rates(last, read_bytes, write_bytes, now):
+    """(read, write) bytes per second since last = (read_bytes, write_bytes, sampled_at)"""
+    if last is None or now <= last[2]:
+        return 0.0, 0.0
+    elapsed = now - last[2]
+    return max(0, read_bytes - last[0]) / elapsed, max(0, write_bytes - last[1]) / elapsed
+
+def _proc_starttime(pid):
+    """Start time in clock ticks since boot from /proc/[pid]/stat; fixed for a process's life"""
+    with open(f'/proc/{pid}/stat', 'rb') as f:
+        stat = f.read()
+    return int(stat[stat.rindex(b')') + 2:].split()[19])
+
+class ProcessTable:
+    """PID-keyed cache of psutil processes refreshed incrementally each scan
+    
+    Entries are keyed on (pid, start time) so a recycled PID starts a fresh
+    entry; on Linux the start time is checked with one small /proc read,
+    elsewhere through psutil. Username and name are resolved once per
+    process; only the CPU, memory and I/O counters and the parent and group
+    ids are read on later scans.
+    """
+    
+    def __init__(self):
+        self._linux = sys.platform.startswith('linux')
+        # pid -> (start time, Process, username, name)
+        self._entries = {}
+        # pid -> (read_bytes, write_bytes, sampled_at) from the previous scan
+        self._io = {}
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _add(self, pid):
+        proc = psutil.Process(pid)
+        info = proc.as_dict(['create_time', 'username', 'name'])
+        started = _proc_starttime(pid) if self._linux else info['create_time']
+        entry = (started, proc, info['username'], info['name'])
+        self._entries[pid] = entry
+        return entry
+    
+    def _same_process(self, pid, entry):
+        """Whether pid still belongs to the process cached in entry"""
+        if not self._linux:
+            return entry[1].is_running()
+        try:
+            return _proc_starttime(pid) == entry[0]
+        except OSError:
+            return False
+    
+    def scan(self):
+        """Yield a ProcessSample for every live process"""
+        entries = self._entries
+        io = self._io
+        live = set(psutil.pids())
+        for pid in entries.keys() - live:
+            del entries[pid]
+            io.pop(pid, None)
+        
+        for pid in live:
+            try:
+                entry = entries.get(pid)
+                if entry is not None and not self._same_process(pid, entry):
+                    # PID was recycled by a newer process
+                    entry = None
+                    io.pop(pid, None)
+                if entry is None:
+                    entry = self._add(pid)
+                _, proc, username, name = entry
+                if not username:
+                    continue
+                with proc.oneshot():
+                    cpu_percent = proc.cpu_percent()
+                    memory_info = proc.memory_info()
+                    ppid = proc.ppid()
+                    pgid = os.getpgid(pid)
+                    try:
+                        counters = proc.io_counters()
+                    except (psutil.AccessDenied, AttributeError):
+                        # Other users' I/O needs privileges; macOS has no io_counters
+                        counters = None
+            except (psutil.NoSuchProcess, psutil.ZombieProcess, ProcessLookupError):
+                entries.pop(pid, None)
+                io.pop(pid, None)
+                continue
+            except psutil.AccessDenied:
+                continue
+            read_rate = write_rate = 0.0
+            if counters is not None:
+                now = time.monotonic()
+                read_rate, write_rate = _io_rates(io.get(pid), counters.read_bytes, counters.write_bytes, now)
+                io[pid] = (counters.read_bytes, counters.write_bytes, now)
+            yield ProcessSample(pid, username, name, cpu_percent, memory_info.rss, read_rate, write_rate,
+                                ppid, pgid)
+
+# uid -> username, shared by the /proc scanner and the cgroup accounting
+_usernames = {}
+
+def uid_username(uid):
+    """Map a uid to a username through a cached pwd lookup"""
+    username = _usernames.get(uid)
+    if username is None:
+        try:
+            username = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            username = str(uid)
+        _usernames[uid] = username
+    return username
+
+class ProcFsTable:
+    """Linux process table reading /proc/[pid]/stat and statm directly
+    
+    Produces the same ProcessSample stream as ProcessTable without creating a
+    psutil object per process. CPU percent is computed from utime+stime deltas
+    the same way psutil does, so per-user aggregates match.
+    """
+    
+    def __init__(self, proc_root='/proc'):
+        self.proc_root = proc_root
+        # pid -> (starttime, username, name, cpu_ticks, sampled_at, read_bytes, write_bytes)
+        self._entries = {}
+        self._buf = bytearray(PROCFS_READ_SIZE)
+        self._clock_ticks = os.sysconf('SC_CLK_TCK')
+        self._page_size = os.sysconf('SC_PAGE_SIZE')
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _read(self, path):
+        """Read a small /proc file into the shared buffer"""
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            size = os.readv(fd, [self._buf])
+        finally:
+            os.close(fd)
+        return bytes(self._buf[:size])
+    
+    def _static_info(self, pid, comm):
+        """Resolve the username and name of a newly seen process"""
+        status = self._read(f'{self.proc_root}/{pid}/status')
+        uid_line = status[status.index(b'\nUid:') + 5:]
+        username = uid_username(int(uid_line.split(None, 1)[0]))
         
-        gpu_processes = {}
-        if result.returncode == 0:
-            for line in result.stdout.strip().split('\n'):
-                if line.strip():
-                    parts = line.split(', ')
-                    if len(parts) >= 3:
-                        pid = int(parts[0])
-                        gpu_processes[pid] = {
-                            'name': parts[1],
-                            'gpu_memory': int(parts[2]) if parts[2].isdigit() else 0
-                        }
-        return gpu_processes
-    except:
-        return {}
-
-def get_user_processes():
-    """Get processes organized by user with resource usage"""
+        name = comm.decode(errors='replace')
+        if len(name) >= 15:
+            # comm is truncated by the kernel; recover the full name like psutil does
+            try:
+                with open(f'{self.proc_root}/{pid}/cmdline', 'rb') as f:
+                    argv0 = f.read().split(b'\0', 1)[0].decode(errors='replace')
+            except OSError:
+                argv0 = ''
+            extended_name = os.path.basename(argv0)
+            if extended_name.startswith(name):
+                name = extended_name
+        return username, name
+    
+    def _io_counters(self, pid):
+        """(read_bytes, write_bytes) from /proc/[pid]/io, or (None, None) if unreadable"""
+        try:
+            io = self._read(f'{self.proc_root}/{pid}/io')
+            # Same storage-level fields psutil reports as read_bytes/write_bytes
+            read_at = io.index(b'\nread_bytes: ') + 13
+            write_at = io.index(b'\nwrite_bytes: ') + 14
+            return int(io[read_at:io.index(b'\n', read_at)]), int(io[write_at:io.index(b'\n', write_at)])
+        except (OSError, ValueError):
+            # Other users' processes need privileges
+            return None, None
+    
+    def scan(self):
+        """Yield a ProcessSample for every live process"""
+        entries = self._entries
+        root = self.proc_root
+        now = time.monotonic()
+        live = [int(name) for name in os.listdir(root) if name.isdigit()]
+        for pid in entries.keys() - set(live):
+            del entries[pid]
+        
+        for pid in live:
+            try:
+                stat = self._read(f'{root}/{pid}/stat')
+                comm_end = stat.rindex(b')')
+                fields = stat[comm_end + 2:].split()
+                cpu_ticks = int(fields[11]) + int(fields[12])
+                starttime = int(fields[19])
+                ppid = int(fields[1])
+                pgid = int(fields[2])
+                entry = entries.get(pid)
+                if entry is None or entry[0] != starttime:
+                    comm = stat[stat.index(b'(') + 1:comm_end]
+                    entry = (starttime, *self._static_info(pid, comm), None, None, None, None)
+                statm = self._read(f'{root}/{pid}/statm')
+                rss = int(statm.split(None, 2)[1]) * self._page_size
+            except (FileNotFoundError, ProcessLookupError):
+                entries.pop(pid, None)
+                continue
+            except (OSError, ValueError, IndexError):
+                continue
+            
+            _, username, name, last_ticks, last_sampled, last_read, last_write = entry
+            cpu_percent = 0.0
+            if last_sampled is not None and now > last_sampled:
+                cpu_seconds = (cpu_ticks - last_ticks) / self._clock_ticks
+                cpu_percent = cpu_seconds / (now - last_sampled) * 100
+            read_bytes, write_bytes = self._io_counters(pid)
+            read_rate = write_rate = 0.0
+            if read_bytes is not None and last_read is not None:
+                read_rate, write_rate = _io_rates((last_read, last_write, last_sampled), read_bytes, write_bytes, now)
+            entries[pid] = (starttime, username, name, cpu_ticks, now, read_bytes, write_bytes)
+            yield ProcessSample(pid, username, name, cpu_percent, rss, read_rate, write_rate, ppid, pgid)
+
+# Process table implementations selectable with --process-backend
+PROCESS_BACKENDS = {
+    'psutil': ProcessTable,
+    'procfs': ProcFsTable
+}
+
+process_table = ProcessTable()
+
+# Exact per-user totals from one cgroup v2 user slice
+CgroupUserSample = namedtuple('CgroupUserSample', ['username', 'cpu_percent', 'memory_bytes',
+                                                   'io_read_rate', 'io_write_rate'])
+
+class CgroupUserAccounting:
+    """Per-user totals read from systemd's user-<uid>.slice cgroups (cgroup v2)
+    
+    cpu.stat, memory.current and io.stat cover every process in a user's
+    slice, including short-lived ones and those below the listing
+    thresholds, at a cost of a few file reads per logged-in user. CPU and
+    I/O rates are computed from counter deltas between samples.
+    """
+    
+    def __init__(self, cgroup_root=CGROUP_ROOT):
+        self.slice_root = os.path.join(cgroup_root, 'user.slice')
+        # uid -> (usage_usec, read_bytes, write_bytes, sampled_at)
+        self._last = {}
+    
+    @staticmethod
+    def available(cgroup_root=CGROUP_ROOT):
+        """Whether cgroup v2 user slices exist under cgroup_root"""
+        return (os.path.exists(os.path.join(cgroup_root, 'cgroup.controllers'))
+                and os.path.isdir(os.path.join(cgroup_root, 'user.slice')))
+    
+    @staticmethod
+    def _read_counters(path):
+        """Return (usage_usec, read_bytes, write_bytes, memory_bytes) for one slice"""
+        with open(os.path.join(path, 'cpu.stat'), 'rb') as f:
+            usage_usec = next(int(line.split()[1]) for line in f if line.startswith(b'usage_usec '))
+        with open(os.path.join(path, 'memory.current'), 'rb') as f:
+            memory_bytes = int(f.read())
+        read_bytes = write_bytes = 0
+        try:
+            with open(os.path.join(path, 'io.stat'), 'rb') as f:
+                for line in f:
+                    # "<major>:<minor> rbytes=N wbytes=N rios=N ..." per device
+                    for field in line.split()[1:]:
+                        key, _, value = field.partition(b'=')
+                        if key == b'rbytes':
+                            read_bytes += int(value)
+                        elif key == b'wbytes':
+                            write_bytes += int(value)
+        except FileNotFoundError:
+            # The io controller is not enabled for user slices
+            pass
+        return usage_usec, read_bytes, write_bytes, memory_bytes
+    
+    def sample(self):
+        """Return a CgroupUserSample per user slice, keyed by username"""
+        now = time.monotonic()
+        samples = {}
+        seen = set()
+        for name in os.listdir(self.slice_root):
+            if not (name.startswith('user-') and name.endswith('.slice') and name[5:-6].isdigit()):
+                continue
+            uid = int(name[5:-6])
+            try:
+                usage_usec, read_bytes, write_bytes, memory_bytes = self._read_counters(
+                    os.path.join(self.slice_root, name))
+            except (OSError, ValueError, IndexError, StopIteration):
+                # Slice removed on logout between listdir and the reads, or an unexpected format
+                continue
+            seen.add(uid)
+            cpu_percent = io_read_rate = io_write_rate = 0.0
+            last = self._last.get(uid)
+            if last is not None and now > last[3]:
+                elapsed = now - last[3]
+                cpu_percent = max(0, usage_usec - last[0]) / 1e6 / elapsed * 100
+                io_read_rate = max(0, read_bytes - last[1]) / elapsed
+                io_write_rate = max(0, write_bytes - last[2]) / elapsed
+            self._last[uid] = (usage_usec, read_bytes, write_bytes, now)
+            username = uid_username(uid)
+            samples[username] = CgroupUserSample(username, cpu_percent, memory_bytes,
+                                                 io_read_rate, io_write_rate)
+        for uid in self._last.keys() - seen:
+            del self._last[uid]
+        return samples
+
+def make_user_accounting(name='auto', cgroup_root=CGROUP_ROOT):
+    """Create the per-user accounting source for --user-accounting, or None to sum processes"""
+    if name == 'cgroup' or (name == 'auto' and CgroupUserAccounting.available(cgroup_root)):
+        return CgroupUserAccounting(cgroup_root)
+    return None
+
+user_accounting = None
+
+def _process_entry(pid, name, cpu_percent, memory_mb, read_rate, write_rate, gpu_memory=None, gpu_usage=0.0):
+    """Payload entry for one process or job; GPU and I/O fields only when non-zero"""
+    process = {
+        'pid': pid,
+        'name': name,
+        'cpu_percent': round(cpu_percent, 1),
+        'memory_mb': round(memory_mb, 1)
+    }
+    if gpu_memory is not None:
+        process['gpu_memory'] = gpu_memory
+        process['gpu_usage'] = round(gpu_usage, 1)
+    if read_rate or write_rate:
+        process['read_rate'] = round(read_rate)
+        process['write_rate'] = round(write_rate)
+    return process
+
+def _job_root(group):
+    """The job's top ancestor: the lowest PID whose parent is outside the group"""
+    if len(group) == 1:
+        return group[0]
+    pids = {proc.pid for proc in group}
+    return min((proc for proc in group if proc.ppid not in pids), key=lambda proc: proc.pid, default=group[0])
+
+class JobTable:
+    """Members of each multi-process job from the latest scan, for on-demand drill-down"""
+    
+    def __init__(self):
+        # (root pid -> (username, member samples), pid -> GPU use) for the latest scan
+        self._latest = ({}, {})
+    
+    def publish(self, jobs, gpu_processes):
+        """Replace the jobs with those of a new scan"""
+        self._latest = (jobs, gpu_processes)
+    
+    def members(self, pid):
+        """Return (username, processes in tree order) for the job rooted at pid, or None"""
+        jobs, gpu_processes = self._latest
+        job = jobs.get(pid)
+        if job is None:
+            return None
+        username, group = job
+        # ppid index over the group; processes whose parent left the group are extra roots
+        pids = {proc.pid for proc in group}
+        children = defaultdict(list)
+        roots = []
+        for proc in sorted(group, key=lambda proc: proc.pid, reverse=True):
+            (children[proc.ppid] if proc.ppid in pids else roots).append(proc)
+        
+        processes = []
+        stack = [(proc, 0) for proc in roots]
+        while stack:
+            proc, depth = stack.pop()
+            gpu_proc = gpu_processes.get(proc.pid)
+            process = _process_entry(proc.pid, proc.name, proc.cpu_percent, proc.rss / (1024 * 1024),
+                                     proc.read_rate, proc.write_rate,
+                                     gpu_proc['gpu_memory'] if gpu_proc else None,
+                                     gpu_proc['gpu_usage'] if gpu_proc else 0.0)
+            process['ppid'] = proc.ppid
+            process['depth'] = depth
+            processes.append(process)
+            stack.extend((child, depth + 1) for child in children[proc.pid])
+        return username, processes
+
+job_table = JobTable()
+
+def get_user_processes(table=None, gpu_processes=None, user_totals=None):
+    """Get jobs organized by user with resource usage
+    
+    Each listed entry is a job, a process group rolled up under its top
+    ancestor; job_table keeps the member processes for drill-down.
+    user_totals maps usernames to CgroupUserSample totals that replace the
+    per-job sums; listed jobs are then only the drill-down.
+    """
+    if table is None:
+        table = process_table
+    if gpu_processes is None:
+        gpu_processes = get_gpu_processes_nvidia()
+    
     user_data = defaultdict(lambda: {
         'cpu_usage': 0.0,
         'memory_usage': 0.0,
+        'gpu_usage': 0.0,
+        'gpu_memory': 0,
+        'gpu_devices': set(),
         'processes': []
     })
+    # username -> [read, write] bytes per second, over every process and not only listed ones
+    io_totals = defaultdict(lambda: [0.0, 0.0])
+    # (username, process group) -> member ProcessSamples
+    groups = defaultdict(list)
     
-    gpu_processes = get_gpu_processes_nvidia()
     total_memory = psutil.virtual_memory().total
     
     try:
-        # Get all processes
-        for proc in psutil.process_iter(['pid', 'username', 'name', 'cpu_percent', 'memory_info']):
-            try:
-                proc_info = proc.info
-                username = proc_info['username']
-                
-                if username and proc_info['cpu_percent'] is not None:
-                    cpu_percent = proc_info['cpu_percent']
-                    memory_bytes = proc_info['memory_info'].rss if proc_info['memory_info'] else 0
-                    memory_mb = memory_bytes / (1024 * 1024)
-                    memory_percent = (memory_bytes / total_memory) * 100
-                    
-                    # Only include processes with significant resource usage
-                    if cpu_percent > 1.0 or memory_mb > 50:
-                        user_data[username]['cpu_usage'] += cpu_percent
-                        user_data[username]['memory_usage'] += memory_percent
-                        
-                        # Check if this process is using GPU
-                        gpu_info = ""
-                        if proc_info['pid'] in gpu_processes:
-                            gpu_mem = gpu_processes[proc_info['pid']]['gpu_memory']
-                            gpu_info = f" (GPU: {gpu_mem}MB)"
-                        
-                        user_data[username]['processes'].append({
-                            'pid': proc_info['pid'],
-                            'name': proc_info['name'] + gpu_info,
-                            'cpu_percent': round(cpu_percent, 1),
-                            'memory_mb': round(memory_mb, 1)
-                        })
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                continue
+        # Refresh the cached process table
+        for proc in table.scan():
+            # A process group is a shell job: a launcher and the workers it forks share one
+            groups[(proc.username, proc.pgid or -proc.pid)].append(proc)
     except Exception as e:
-        print(f"Error getting user processes: {e}")
+        self_metrics.error('user_processes', f"Error getting user processes: {e}")
+    
+    jobs = {}
+    for (username, _), group in groups.items():
+        root = _job_root(group)
+        cpu_percent = read_rate = write_rate = gpu_usage = 0.0
+        memory_bytes = gpu_memory = 0
+        gpu_devices = set()
+        for proc in group:
+            cpu_percent += proc.cpu_percent
+            memory_bytes += proc.rss
+            read_rate += proc.read_rate
+            write_rate += proc.write_rate
+            gpu_proc = gpu_processes.get(proc.pid)
+            if gpu_proc:
+                gpu_usage += gpu_proc['gpu_usage']
+                gpu_memory += gpu_proc['gpu_memory']
+                gpu_devices.update(gpu_proc['devices'])
+        memory_mb = memory_bytes / (1024 * 1024)
+        io_rate = read_rate + write_rate
+        if io_rate:
+            user_io = io_totals[username]
+            user_io[0] += read_rate
+            user_io[1] += write_rate
+        if len(group) > 1:
+            jobs[root.pid] = (username, group)
+        
+        # Only include jobs with significant resource usage
+        if (cpu_percent > PROCESS_MIN_CPU or memory_mb > PROCESS_MIN_MEMORY_MB
+                or io_rate > PROCESS_MIN_IO_RATE or gpu_devices):
+            user = user_data[username]
+            user['cpu_usage'] += cpu_percent
+            user['memory_usage'] += memory_bytes / total_memory * 100
+            
+            # Attribute GPU use to the owning user
+            if gpu_devices:
+                user['gpu_usage'] += gpu_usage
+                user['gpu_memory'] += gpu_memory
+                user['gpu_devices'].update(gpu_devices)
+            process = _process_entry(root.pid, root.name, cpu_percent, memory_mb, read_rate, write_rate,
+                                     gpu_memory if gpu_devices else None, gpu_usage)
+            process['job_size'] = len(group)
+            user['processes'].append(process)
+    job_table.publish(jobs, gpu_processes)
+    
+    for username, user in user_data.items():
+        user['io_read_rate'], user['io_write_rate'] = io_totals.get(username, (0.0, 0.0))
+    
+    if user_totals:
+        for username, totals in user_totals.items():
+            # Users with a slice but nothing above the thresholds are still reported
+            user = user_data[username]
+            user['cpu_usage'] = totals.cpu_percent
+            user['memory_usage'] = totals.memory_bytes / total_memory * 100
+            user['io_read_rate'] = totals.io_read_rate
+            user['io_write_rate'] = totals.io_write_rate
     
     # Sort processes by CPU usage for each user
     for username in user_data:
@@ -657,12 +872,19 @@ def get_user_processes():
     # Convert to list and sort by total CPU usage
     users_list = []
     for username, data in user_data.items():
-        users_list.append({
+        entry = {
             'username': username,
             'cpu_usage': data['cpu_usage'],
             'memory_usage': data['memory_usage'],
+            'gpu_usage': round(data['gpu_usage'], 1),
+            'gpu_memory': data['gpu_memory'],
+            'gpu_devices': sorted(data['gpu_devices']),
+            'io_read_rate': round(data['io_read_rate']),
+            'io_write_rate': round(data['io_write_rate']),
+            'process_count': len(data['processes']),
             'processes': data['processes']
-        })
+        }
+        users_list.append(entry)
     
     users_list.sort(key=lambda x: x['cpu_usage'], reverse=True)
     return users_list
@@ -680,75 +902,2220 @@ def format_uptime():
     else:
         return f"{hours}h {minutes}m"
 
+# A response body encoded once and shared by every client
+EncodedBody = namedtuple('EncodedBody', ['raw', 'gzipped', 'etag'])
+
+# Distinguishes ETags across restarts, when sequence numbers start over
+INSTANCE_TAG = f'{os.getpid():x}-{int(time.time()):x}'
+
+def event_id(seq):
+    """SSE event id for a snapshot, tagged with this instance"""
+    return f'{INSTANCE_TAG}-{seq}'
+
+def parse_event_id(value):
+    """Sequence number from a Last-Event-ID, or 0 when it was issued by another instance"""
+    tag, _, seq = (value or '').rpartition('-')
+    if tag != INSTANCE_TAG:
+        return 0
+    try:
+        return int(seq)
+    except ValueError:
+        return 0
+
+def encode_body(text, tag, precompress=True):
+    """Encode a JSON payload once, gzipped too when precompress is set"""
+    raw = text.encode()
+    gzipped = gzip.compress(raw, GZIP_LEVEL) if precompress and len(raw) > GZIP_MIN_SIZE else None
+    return EncodedBody(raw, gzipped, f'"{INSTANCE_TAG}-{tag}"')
+
+def cached_body_response(body, if_none_match, accept_encoding, cache_control='no-cache'):
+    """Choose (status, content, headers) for an EncodedBody and request headers"""
+    headers = [('ETag', body.etag), ('Cache-Control', cache_control), ('Vary', 'Accept-Encoding')]
+    if if_none_match and body.etag in [tag.strip() for tag in if_none_match.split(',')]:
+        return 304, b'', headers
+    if body.gzipped is not None and 'gzip' in (accept_encoding or ''):
+        return 200, body.gzipped, headers + [('Content-Encoding', 'gzip')]
+    return 200, body.raw, headers
+
+def load_static_assets(directory):
+    """Load front-end assets once, keyed by content-hashed file name
+    
+    Returns the assets and a map from each plain file name to its URL.
+    """
+    assets, urls = {}, {}
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as f:
+            raw = f.read()
+        digest = hashlib.sha256(raw).hexdigest()[:12]
+        stem, ext = os.path.splitext(name)
+        hashed = f'{stem}.{digest}{ext}'
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/'):
+            content_type += '; charset=utf-8'
+        body = EncodedBody(raw, gzip.compress(raw, GZIP_LEVEL), f'"{digest}"')
+        assets[hashed] = (content_type, body)
+        urls[name] = f'/assets/{hashed}'
+    return assets, urls
+
+STATIC_ASSETS, ASSET_URLS = load_static_assets(os.path.join(BASE_DIR, 'static'))
+
+def render_index_page():
+    """Render the page once; the hostname is its only dynamic value"""
+    with app.app_context():
+        html = render_template('index.html', hostname=HOSTNAME,
+                               css_url=ASSET_URLS['monitor.css'], js_url=ASSET_URLS['monitor.js'])
+    raw = html.encode()
+    return EncodedBody(raw, gzip.compress(raw, GZIP_LEVEL), f'"{hashlib.sha256(raw).hexdigest()[:12]}"')
+
+index_page = render_index_page()
+
 @app.route('/')
 def index():
     """Serve the main monitoring page"""
-    import socket
-    hostname = socket.gethostname()
-    return render_template_string(HTML_TEMPLATE, hostname=hostname)
+    status, content, headers = cached_body_response(
+        index_page, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+    return Response(content, status=status, headers=headers, mimetype='text/html')
 
-@app.route('/api/system-data')
-def system_data():
-    """API endpoint for system data"""
-    try:
-        # CPU usage
-        cpu_usage = psutil.cpu_percent(interval=1)
-        
-        # Memory usage
-        memory = psutil.virtual_memory()
-        memory_used_gb = memory.used / (1024**3)
-        memory_total_gb = memory.total / (1024**3)
-        
-        # GPU info
-        gpu_info = get_gpu_info()
+@app.route('/assets/<name>')
+def static_asset(name):
+    """Serve a content-hashed asset; its URL changes whenever it does"""
+    if name not in STATIC_ASSETS:
+        return jsonify({'error': 'Not found'}), 404
+    content_type, body = STATIC_ASSETS[name]
+    status, content, headers = cached_body_response(
+        body, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'),
+        cache_control=ASSET_CACHE_CONTROL)
+    return Response(content, status=status, headers=headers, content_type=content_type)
+
+def _cpu_busy_total(times):
+    """Split a cpu_times record into (busy, total) seconds"""
+    total = sum(times)
+    idle = times.idle + getattr(times, 'iowait', 0.0)
+    # guest time is already counted in user/nice on Linux
+    total -= getattr(times, 'guest', 0.0) + getattr(times, 'guest_nice', 0.0)
+    return total - idle, total
+
+class CpuAccounting:
+    """Track CPU utilisation from cpu_times deltas between samples"""
+    
+    def __init__(self):
+        self._last = [_cpu_busy_total(t) for t in psutil.cpu_times(percpu=True)]
+    
+    def sample(self):
+        """Return (total_percent, per_core_percents) since the previous sample"""
+        current = [_cpu_busy_total(t) for t in psutil.cpu_times(percpu=True)]
+        per_core = []
+        busy_sum = total_sum = 0.0
+        for (busy, total), (last_busy, last_total) in zip(current, self._last):
+            busy_delta = max(0.0, busy - last_busy)
+            total_delta = max(0.0, total - last_total)
+            busy_sum += busy_delta
+            total_sum += total_delta
+            per_core.append(round(min(100.0, busy_delta / total_delta * 100), 1) if total_delta else 0.0)
+        self._last = current
+        usage = min(100.0, busy_sum / total_sum * 100) if total_sum else 0.0
+        return round(usage, 1), per_core
+
+cpu_accounting = CpuAccounting()
+
+class IoAccounting:
+    """Track host disk and network throughput from counter deltas between samples"""
+    
+    def __init__(self):
+        self._last = self._read()
+    
+    @staticmethod
+    def _read():
+        """(sampled_at, disk read, disk written, net received, net sent) cumulative bytes"""
+        disk = psutil.disk_io_counters()
+        # Loopback traffic never leaves the host
+        nics = [counters for nic, counters in psutil.net_io_counters(pernic=True).items() if nic != 'lo']
+        return (time.monotonic(),
+                disk.read_bytes if disk else 0,
+                disk.write_bytes if disk else 0,
+                sum(nic.bytes_recv for nic in nics),
+                sum(nic.bytes_sent for nic in nics))
+    
+    def sample(self):
+        """Return disk and network bytes per second since the previous sample"""
+        current = self._read()
+        elapsed = current[0] - self._last[0]
+        rates = [max(0, now - last) / elapsed if elapsed > 0 else 0.0
+                 for now, last in zip(current[1:], self._last[1:])]
+        self._last = current
+        return dict(zip(('disk_read_rate', 'disk_write_rate', 'net_recv_rate', 'net_sent_rate'),
+                        (round(rate) for rate in rates)))
+
+io_accounting = IoAccounting()
+
+def collect_system_data(previous=None):
+    """Collect one full system snapshot
+    
+    With previous snapshot data only the cheap host metrics are refreshed;
+    GPU and per-user values are carried over from it instead of rescanned.
+    """
+    # CPU usage since the previous snapshot
+    with self_metrics.timed('cpu'):
+        cpu_usage, cpu_per_core = cpu_accounting.sample()
+    
+    # Disk and network throughput since the previous snapshot
+    with self_metrics.timed('io'):
+        io = io_accounting.sample()
+    
+    # Memory usage
+    memory = psutil.virtual_memory()
+    memory_used_gb = memory.used / (1024**3)
+    memory_total_gb = memory.total / (1024**3)
+    
+    if previous is not None:
+        gpu_info = previous['gpu']
+        users = previous['users']
+        active_users = previous['active_user_count']
+    else:
+        # GPU info, one backend query shared by the device and per-process views
+        with self_metrics.timed('gpu_sample'):
+            gpu_sample = gpu_backend.sample()
+        with self_metrics.timed('gpu_info'):
+            gpu_info = get_gpu_info(gpu_sample)
+        with self_metrics.timed('gpu_processes'):
+            gpu_processes = get_gpu_processes_nvidia(gpu_sample)
         
         # User processes
-        users = get_user_processes()
+        user_totals = None
+        if user_accounting is not None:
+            try:
+                with self_metrics.timed('user_accounting'):
+                    user_totals = user_accounting.sample()
+            except OSError as e:
+                self_metrics.error('user_accounting', f"Error reading user cgroups: {e}")
+        with self_metrics.timed('user_processes'):
+            users = get_user_processes(gpu_processes=gpu_processes, user_totals=user_totals)
         active_users = sum(1 for user in users if user['cpu_usage'] > 5 or len(user['processes']) > 0)
+    
+    # System info
+    return {
+        'cpu': {
+            'usage': cpu_usage,
+            'per_core': cpu_per_core,
+            'temperature': get_cpu_temperature()
+        },
+        'gpu': gpu_info,
+        'memory': {
+            'used': memory_used_gb,
+            'total': memory_total_gb,
+            'display': f"{memory_used_gb:.1f} / {memory_total_gb:.1f} GB"
+        },
+        'io': io,
+        'users': users,
+        'active_user_count': active_users,
+        'uptime': format_uptime(),
+        'timestamp': datetime.now().isoformat()
+    }
+
+def _diff_records(old, new, key):
+    """Diff two lists of dicts keyed by `key` into added/removed/changed"""
+    old_by_key = {item[key]: item for item in old}
+    added, changed = [], []
+    for item in new:
+        previous = old_by_key.pop(item[key], None)
+        if previous is None:
+            added.append(item)
+        elif previous != item:
+            changed.append(item)
+    return {'added': added, 'removed': list(old_by_key), 'changed': changed}
+
+def _diff_users(old_users, new_users):
+    """Diff user entries, sending only changed fields and process deltas"""
+    old_by_name = {user['username']: user for user in old_users}
+    added, changed = [], []
+    for user in new_users:
+        previous = old_by_name.pop(user['username'], None)
+        if previous is None:
+            added.append(user)
+            continue
+        if previous == user:
+            continue
+        change = {'username': user['username']}
+        for field, value in user.items():
+            if field == 'processes':
+                if value != previous.get('processes'):
+                    change['processes'] = _diff_records(previous.get('processes', []), value, 'pid')
+            elif previous.get(field) != value:
+                change[field] = value
+        changed.append(change)
+    return {'added': added, 'removed': list(old_by_name), 'changed': changed}
+
+def diff_snapshots(base, snapshot):
+    """Build a delta update from base to snapshot"""
+    data = {key: value for key, value in snapshot.data.items() if key != 'users'}
+    return {
+        'seq': snapshot.seq,
+        'base': base.seq,
+        'full': False,
+        'data': data,
+        'users': _diff_users(base.data['users'], snapshot.data['users'])
+    }
+
+# A published snapshot; never mutated once handed to readers
+Snapshot = namedtuple('Snapshot', ['seq', 'data', 'collected_at', 'payload', 'body'], defaults=[None])
+
+# Parameters narrowing the users payload; None fields leave that aspect unchanged
+UserQuery = namedtuple('UserQuery', ['users', 'sort', 'top', 'page', 'limit', 'min_cpu', 'min_memory_mb'])
+
+# ?sort= values and the user field each ranks by, highest first (username sorts A-Z)
+USER_SORT_KEYS = {
+    'cpu': 'cpu_usage',
+    'memory': 'memory_usage',
+    'gpu': 'gpu_usage',
+    'gpu_memory': 'gpu_memory',
+    'processes': 'process_count',
+    'disk_read': 'io_read_rate',
+    'disk_write': 'io_write_rate',
+    'username': 'username'
+}
+
+def parse_user_query(args):
+    """Build a UserQuery from parse_qs-style arguments, or None if none were given
+    
+    Raises ValueError for malformed values.
+    """
+    def number(name, convert, minimum):
+        values = args.get(name)
+        if not values or values[0] == '':
+            return None
+        value = convert(values[0])
+        if value < minimum:
+            raise ValueError(f"{name} must be at least {minimum}")
+        return value
+    
+    sort = (args.get('sort') or [None])[0]
+    if sort is not None and sort not in USER_SORT_KEYS:
+        raise ValueError(f"sort must be one of {', '.join(sorted(USER_SORT_KEYS))}")
+    users = tuple(sorted(name for name in args.get('user', ()) if name)) or None
+    query = UserQuery(users, sort, number('top', int, 0), number('page', int, 0), number('limit', int, 1),
+                      number('min_cpu', float, 0), number('min_memory_mb', float, 0))
+    return None if query == UserQuery(*[None] * len(UserQuery._fields)) else query
+
+def select_users(data, query):
+    """Return a copy of snapshot data with users filtered, ranked and paged by query"""
+    users = data['users']
+    if query.users:
+        wanted = set(query.users)
+        users = [user for user in users if user['username'] in wanted]
+    
+    if query.min_cpu is not None or query.min_memory_mb is not None:
+        min_cpu = PROCESS_MIN_CPU if query.min_cpu is None else query.min_cpu
+        min_memory = PROCESS_MIN_MEMORY_MB if query.min_memory_mb is None else query.min_memory_mb
+        filtered = []
+        for user in users:
+            processes = [proc for proc in user['processes']
+                         if proc['cpu_percent'] > min_cpu or proc['memory_mb'] > min_memory
+                         or proc.get('read_rate', 0) + proc.get('write_rate', 0) > PROCESS_MIN_IO_RATE
+                         or 'gpu_memory' in proc]
+            if processes:
+                filtered.append({**user, 'processes': processes, 'process_count': len(processes)})
+        users = filtered
+    
+    total = len(users)
+    limit = query.limit
+    page = query.page or 0
+    if query.sort is not None or limit is not None:
+        field = USER_SORT_KEYS[query.sort or 'cpu']
+        # Only the users up to the end of the requested page are ranked
+        wanted = total if limit is None else min(total, (page + 1) * limit)
+        if field == 'username':
+            users = heapq.nsmallest(wanted, users, key=lambda user: user['username'])
+        else:
+            users = heapq.nlargest(wanted, users, key=lambda user: user[field])
+        if limit is not None:
+            users = users[page * limit:]
+    
+    if query.top is not None:
+        # Processes are kept ordered by CPU, so the top N are a prefix
+        users = [{**user, 'processes': user['processes'][:query.top]}
+                 if len(user['processes']) > query.top else user for user in users]
+    
+    view = dict(data)
+    view['users'] = users
+    view['user_total'] = total
+    if limit is not None:
+        view['page'] = {'page': page, 'limit': limit, 'pages': -(-total // limit)}
+    return view
+
+class Sampler:
+    """Background collector that publishes the latest system snapshot
+    
+    Host metrics are sampled every `interval` seconds. The expensive process
+    and GPU scans run every `scan_interval` seconds at most, stretched while
+    the process's own CPU use is over `cpu_budget`. With no stream viewers
+    and no recent polls, sampling slows to `idle_interval`.
+    """
+    
+    def __init__(self, collect=collect_system_data, interval=DEFAULT_SAMPLE_INTERVAL,
+                 scan_interval=DEFAULT_SCAN_INTERVAL, cpu_budget=DEFAULT_CPU_BUDGET):
+        self.collect = collect
+        self.interval = interval
+        self.scan_interval = scan_interval
+        self.cpu_budget = cpu_budget
+        self.idle_interval = IDLE_SAMPLE_INTERVAL
+        self.precompress = True
+        # Current seconds between scans, adapted to the CPU budget
+        self.effective_scan_interval = scan_interval
+        self._last_scan = None
+        self._last_read = time.monotonic()
+        self._wake = threading.Event()
+        self._snapshot = None
+        self._history = deque(maxlen=DELTA_HISTORY)
+        # Encoded updates and views for the current tick; replaced on every publish
+        self._tick_cache = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._updated = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+        self.subscribers = 0
+    
+    def start(self):
+        """Start the collector thread if it is not already running"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+            self._thread.start()
+    
+    def stop(self, timeout=None):
+        """Ask the collector thread to exit and wait for it"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+    
+    def add_listener(self, listener):
+        """Call listener(snapshot) in the collector thread after each publish"""
+        self._listeners.append(listener)
+    
+    def remove_listener(self, listener):
+        """Stop calling a listener added with add_listener"""
+        self._listeners.remove(listener)
+    
+    def subscribe(self):
+        """Register a push-stream viewer"""
+        with self._lock:
+            self.subscribers += 1
+        self._wake.set()
+    
+    def unsubscribe(self):
+        """Drop a push-stream viewer"""
+        with self._lock:
+            self.subscribers -= 1
+    
+    @property
+    def watched(self):
+        """Whether anyone is streaming or has polled within VIEWER_IDLE_SECONDS"""
+        return self.subscribers > 0 or time.monotonic() - self._last_read < VIEWER_IDLE_SECONDS
+    
+    def _note_read(self):
+        """Record a poll, waking the collector if it had backed off"""
+        if not self.watched:
+            self._wake.set()
+        self._last_read = time.monotonic()
+    
+    @property
+    def current(self):
+        """The most recent snapshot, or None; never blocks"""
+        return self._snapshot
+    
+    def latest(self, timeout=None):
+        """Return the most recent snapshot, starting the collector if needed"""
+        if self._snapshot is None:
+            return self.wait_for_update(0, timeout)
+        return self._snapshot
+    
+    def wait_for_update(self, after_seq, timeout=None):
+        """Block until a snapshot newer than after_seq is published"""
+        self.start()
+        with self._updated:
+            self._updated.wait_for(
+                lambda: self._snapshot is not None and self._snapshot.seq > after_seq,
+                timeout)
+        return self._snapshot
+    
+    def sample_once(self, scan=True):
+        """Collect and publish a single snapshot, rescanning processes unless scan is False"""
+        scan = scan or self._snapshot is None
+        with self_metrics.timed('collect_scan' if scan else 'collect_host'):
+            data = self.collect() if scan else self.collect(self._snapshot.data)
+        self._seq += 1
+        with self_metrics.timed('json_encode'):
+            payload = json.dumps(data)
+        with self_metrics.timed('body_encode'):
+            body = encode_body(payload, self._seq, self.precompress)
+        snapshot = Snapshot(self._seq, data, time.time(), payload, body)
+        with self._updated:
+            # Swapping the reference is atomic, so readers never see a partial snapshot
+            self._snapshot = snapshot
+            self._history.append(snapshot)
+            self._tick_cache = {}
+            self._updated.notify_all()
+        for listener in self._listeners:
+            try:
+                with self_metrics.timed('listeners'):
+                    listener(snapshot)
+            except Exception as e:
+                self_metrics.error('listener', f"Error in snapshot listener {listener!r}: {e}")
+        return snapshot
+    
+    def view(self, snapshot, query):
+        """Snapshot narrowed by a UserQuery, built once per (query, seq)"""
+        if query is None:
+            return snapshot
+        key = ('view', query, snapshot.seq)
+        view = self._tick_cache.get(key)
+        if view is None:
+            data = select_users(snapshot.data, query)
+            view = self._tick_cache[key] = snapshot._replace(data=data, payload=json.dumps(data), body=None)
+        return view
+    
+    def _base(self, snapshot, since):
+        """Retained snapshot at seq `since` to diff snapshot against, or None for a full resync"""
+        if 0 < since <= snapshot.seq:
+            return next((s for s in self._history if s.seq == since), None)
+        return None
+    
+    def update_payload(self, snapshot, since, query=None):
+        """Return the JSON update bringing a client at seq `since` up to snapshot"""
+        base = self._base(snapshot, since)
+        if base is None:
+            # Every client needing a resync shares one key, whatever seq it sent
+            since = 0
+        key = ('payload', since, snapshot.seq, query)
+        cache = self._tick_cache
+        payload = cache.get(key)
+        if payload is None:
+            view = self.view(snapshot, query)
+            if base is None:
+                payload = '{"seq": %d, "full": true, "data": %s}' % (snapshot.seq, view.payload)
+            else:
+                payload = json.dumps(diff_snapshots(self.view(base, query), view))
+            # Every client on the same seq shares one diff and one encode per tick
+            cache[key] = payload
+        return payload
+    
+    def response_body(self, snapshot, since=None, query=None):
+        """EncodedBody for a plain (since=None) or update request, built once per tick"""
+        self._note_read()
+        if since is None and query is None:
+            return snapshot.body
+        if since is not None and self._base(snapshot, since) is None:
+            since = 0
+        key = ('body', since, snapshot.seq, query)
+        cache = self._tick_cache
+        body = cache.get(key)
+        if body is None:
+            if since is None:
+                text = self.view(snapshot, query).payload
+            else:
+                text = self.update_payload(snapshot, since, query)
+            tag = f'{since}-{snapshot.seq}-{hashlib.sha1(repr(query).encode()).hexdigest()[:8]}'
+            body = cache[key] = encode_body(text, tag, self.precompress)
+        return body
+    
+    def _adapt_scan_interval(self, cpu_fraction):
+        """Stretch scans while over the CPU budget, and relax them when well under it"""
+        if cpu_fraction > self.cpu_budget:
+            self.effective_scan_interval = min(SCAN_INTERVAL_MAX, self.effective_scan_interval * 1.5)
+        elif cpu_fraction < self.cpu_budget / 2:
+            self.effective_scan_interval = max(self.scan_interval, self.effective_scan_interval / 1.5)
+    
+    def _run(self):
+        window_started = time.monotonic()
+        window_cpu = time.process_time()
+        while not self._stop.is_set():
+            started = time.monotonic()
+            scan = self._last_scan is None or started - self._last_scan >= self.effective_scan_interval
+            try:
+                self.sample_once(scan)
+            except Exception as e:
+                self_metrics.error('collect', f"Error collecting system data: {e}")
+            if scan:
+                self._last_scan = started
+            
+            # The budget covers everything the monitor does, including serving requests
+            now = time.monotonic()
+            if now - window_started >= BUDGET_WINDOW:
+                cpu = time.process_time()
+                self._adapt_scan_interval((cpu - window_cpu) / (now - window_started))
+                window_started, window_cpu = now, cpu
+            
+            interval = self.interval if self.watched else max(self.interval, self.idle_interval)
+            self._wake.wait(max(0.0, interval - (now - started)))
+            self._wake.clear()
+
+class RingBuffer:
+    """Fixed-capacity, array-backed ring of timestamped metric rows
+    
+    The arrays grow with the rows held until capacity is reached, so a
+    short-lived series costs only what it stores.
+    """
+    
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._times = array('d')
+        self._columns = [array('d') for _ in self.fields]
+        self._start = 0
+        self._count = 0
+    
+    def __len__(self):
+        return self._count
+    
+    def append(self, timestamp, values):
+        """Store one row, overwriting the oldest once full"""
+        if self._count < self.capacity:
+            self._count += 1
+            self._times.append(timestamp)
+            for column, value in zip(self._columns, values):
+                column.append(value)
+            return
+        slot = self._start
+        self._start = (self._start + 1) % self.capacity
+        self._times[slot] = timestamp
+        for column, value in zip(self._columns, values):
+            column[slot] = value
+    
+    def full(self):
+        """Whether rows are now being overwritten"""
+        return self._count == self.capacity
+    
+    def oldest(self):
+        """Timestamp of the oldest retained row, or None when empty"""
+        return self._times[self._start] if self._count else None
+    
+    def newest(self):
+        """Timestamp of the newest row, or None when empty"""
+        return self._times[(self._start + self._count - 1) % self.capacity] if self._count else None
+    
+    def _time_at(self, i):
+        return self._times[(self._start + i) % self.capacity]
+    
+    def query(self, start=None, end=None):
+        """Return rows with start <= timestamp <= end as column lists"""
+        # Rows are appended in time order, so the range is found by bisection
+        first = 0 if start is None else bisect_left(range(self._count), start, key=self._time_at)
+        last = self._count if end is None else bisect_right(range(self._count), end, key=self._time_at)
+        slots = [(self._start + i) % self.capacity for i in range(first, last)]
+        result = {'timestamps': [self._times[slot] for slot in slots]}
+        for field, column in zip(self.fields, self._columns):
+            result[field] = [column[slot] for slot in slots]
+        return result
+
+class RollupBuffer:
+    """Ring of fixed-width time buckets holding mean, min and max per field
+    
+    Query rows use the plain field name for the bucket mean, so consumers can
+    read a rollup exactly like raw history, plus <field>_min and <field>_max.
+    """
+    
+    def __init__(self, fields, step, capacity):
+        self.fields = tuple(fields)
+        self.step = step
+        self.ring = RingBuffer([name for field in self.fields
+                                for name in (field, f'{field}_min', f'{field}_max')], capacity)
+        self._bucket = None
+        self._count = 0
+        self._sums = self._mins = self._maxs = None
+    
+    def __len__(self):
+        return len(self.ring) + (1 if self._count else 0)
+    
+    def append(self, timestamp, values):
+        """Fold one sample into its bucket, closing the previous bucket if needed"""
+        bucket = timestamp - timestamp % self.step
+        if bucket != self._bucket:
+            self._flush()
+            self._bucket = bucket
+            self._sums = list(values)
+            self._mins = list(values)
+            self._maxs = list(values)
+            self._count = 1
+            return
+        self._count += 1
+        for i, value in enumerate(values):
+            self._sums[i] += value
+            if value < self._mins[i]:
+                self._mins[i] = value
+            elif value > self._maxs[i]:
+                self._maxs[i] = value
+    
+    def _current_row(self):
+        return [value for i in range(len(self.fields))
+                for value in (self._sums[i] / self._count, self._mins[i], self._maxs[i])]
+    
+    def _flush(self):
+        if self._count:
+            self.ring.append(self._bucket, self._current_row())
+            self._count = 0
+    
+    def full(self):
+        """Whether closed buckets are now being overwritten"""
+        return self.ring.full()
+    
+    def oldest(self):
+        """Start of the oldest retained bucket, or None when empty"""
+        oldest = self.ring.oldest()
+        return self._bucket if oldest is None and self._count else oldest
+    
+    def newest(self):
+        """Start of the newest bucket, including the one still filling"""
+        return self._bucket if self._count else self.ring.newest()
+    
+    def query(self, start=None, end=None):
+        """Return closed buckets in range plus the one still filling"""
+        result = self.ring.query(start, end)
+        if self._count and (end is None or self._bucket <= end) and \
+                (start is None or self._bucket + self.step > start):
+            result['timestamps'].append(self._bucket)
+            for name, value in zip(self.ring.fields, self._current_row()):
+                result[name].append(value)
+        return result
+
+class MetricsHistory:
+    """Server-side history of host metrics and per-user aggregates
+    
+    Raw samples are kept for HISTORY_CAPACITY rows and rolled up into coarser
+    tiers (ROLLUP_TIERS), so memory stays fixed however long the server runs.
+    At most max_users users are tracked; when full, a new user replaces the
+    one seen least recently, or is left out if every tracked user is current.
+    """
+    
+    HOST_FIELDS = ('cpu', 'gpu', 'memory')
+    USER_FIELDS = ('cpu', 'memory', 'gpu', 'gpu_memory')
+    
+    def __init__(self, capacity=HISTORY_CAPACITY, tiers=ROLLUP_TIERS, max_users=HISTORY_MAX_USERS):
+        self.capacity = capacity
+        self.tiers = tuple(tiers)
+        self.max_users = max_users
+        self.host = self._new_series(self.HOST_FIELDS)
+        self.users = {}
+        self._lock = threading.Lock()
+    
+    def _new_series(self, fields):
+        """Raw ring followed by one rollup per tier, finest first"""
+        return [RingBuffer(fields, self.capacity)] + \
+            [RollupBuffer(fields, step, buckets) for step, buckets in self.tiers]
+    
+    def record(self, snapshot):
+        """Append one snapshot; used as a sampler listener"""
+        data = snapshot.data
+        timestamp = snapshot.collected_at
+        memory = data['memory']
+        memory_percent = memory['used'] / memory['total'] * 100 if memory['total'] else 0.0
+        host_values = (data['cpu']['usage'], data['gpu']['usage'], memory_percent)
+        with self._lock:
+            for series in self.host:
+                series.append(timestamp, host_values)
+            all_current = False
+            for user in data['users']:
+                user_series = self.users.get(user['username'])
+                if user_series is None:
+                    if len(self.users) >= self.max_users:
+                        if all_current:
+                            continue
+                        stalest = min(self.users, key=lambda name: self.users[name][-1].newest())
+                        if self.users[stalest][-1].newest() >= timestamp:
+                            # Every tracked user is in this snapshot; leave the rest out
+                            all_current = True
+                            continue
+                        del self.users[stalest]
+                    user_series = self.users[user['username']] = self._new_series(self.USER_FIELDS)
+                values = (user['cpu_usage'], user['memory_usage'],
+                          user.get('gpu_usage', 0.0), user.get('gpu_memory', 0))
+                for series in user_series:
+                    series.append(timestamp, values)
+            # Forget users once they have aged out of the longest-retained tier
+            horizon = self.host[-1].oldest()
+            for username in [name for name, series in self.users.items() if series[-1].newest() < horizon]:
+                del self.users[username]
+    
+    def _pick_tier(self, start, resolution):
+        """Index of the tier to answer a query from
+        
+        With a resolution, the coarsest tier whose bucket fits within it;
+        otherwise the finest tier that still reaches back to start.
+        """
+        steps = [0] + [step for step, _ in self.tiers]
+        if resolution is not None:
+            return max(i for i, step in enumerate(steps) if step <= resolution)
+        if start is not None:
+            for i, series in enumerate(self.host):
+                oldest = series.oldest()
+                # A tier that has never dropped a row holds everything coarser tiers do
+                if not series.full() or (oldest is not None and oldest <= start):
+                    return i
+            return len(self.host) - 1
+        return 0
+    
+    def query(self, start=None, end=None, usernames=None, resolution=None):
+        """Return host and per-user series within [start, end]"""
+        with self._lock:
+            tier = self._pick_tier(start, resolution)
+            if usernames is None:
+                usernames = list(self.users)
+            return {
+                'resolution': self.tiers[tier - 1][0] if tier else 0,
+                'host': self.host[tier].query(start, end),
+                'users': {name: self.users[name][tier].query(start, end)
+                          for name in usernames if name in self.users}
+            }
+
+class MetricsArchive:
+    """Durable archive of history rows in append-only, fixed-width segment files
+    
+    Host rows and per-user rows go to separate segment files that start a new
+    file every ARCHIVE_SEGMENT_SECONDS. Usernames are stored once in users.txt
+    and referenced by id. Queries mmap only the segments overlapping the
+    requested range and bisect to the first row, so reading a week does not
+    load the archive into memory.
+    """
+    
+    HOST_RECORD = struct.Struct('<dfff')     # timestamp, cpu, gpu, memory
+    USER_RECORD = struct.Struct('<dIffff')   # timestamp, user id, cpu, memory, gpu, gpu_memory
+    
+    def __init__(self, directory, retention=ARCHIVE_RETENTION, segment_seconds=ARCHIVE_SEGMENT_SECONDS):
+        self.directory = directory
+        self.retention = retention
+        self.segment_seconds = segment_seconds
+        os.makedirs(directory, exist_ok=True)
+        self._names_path = os.path.join(directory, 'users.txt')
+        self._user_ids = {}
+        self._usernames = []
+        if os.path.exists(self._names_path):
+            with open(self._names_path) as f:
+                for name in f.read().splitlines():
+                    self._user_ids[name] = len(self._usernames)
+                    self._usernames.append(name)
+        self._names_file = open(self._names_path, 'a')
+        self._segment = None
+        self._files = {}
+        self._lock = threading.Lock()
+    
+    def _path(self, kind, segment):
+        return os.path.join(self.directory, f'{kind}-{segment}.bin')
+    
+    def _open_segment(self, segment):
+        """Switch appends to the segment starting at `segment`"""
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        for kind, record in (('host', self.HOST_RECORD), ('users', self.USER_RECORD)):
+            f = open(self._path(kind, segment), 'ab')
+            # Drop a partial row left by an interrupted write
+            f.truncate(f.tell() - f.tell() % record.size)
+            self._files[kind] = f
+        self._segment = segment
+        self._expire(segment)
+    
+    def _segments(self, kind):
+        """Sorted segment start times present on disk for `kind`"""
+        starts = []
+        for name in os.listdir(self.directory):
+            if name.startswith(kind + '-') and name.endswith('.bin'):
+                starts.append(int(name[len(kind) + 1:-4]))
+        return sorted(starts)
+    
+    def _expire(self, now):
+        """Delete segments that ended before the retention window"""
+        for kind in ('host', 'users'):
+            for segment in self._segments(kind):
+                if segment + self.segment_seconds < now - self.retention:
+                    os.remove(self._path(kind, segment))
+    
+    def _user_id(self, username):
+        user_id = self._user_ids.get(username)
+        if user_id is None:
+            user_id = self._user_ids[username] = len(self._usernames)
+            self._usernames.append(username)
+            self._names_file.write(username + '\n')
+            self._names_file.flush()
+        return user_id
+    
+    def record(self, snapshot):
+        """Append one snapshot; used as a sampler listener"""
+        data = snapshot.data
+        timestamp = snapshot.collected_at
+        memory = data['memory']
+        memory_percent = memory['used'] / memory['total'] * 100 if memory['total'] else 0.0
+        with self._lock:
+            segment = int(timestamp - timestamp % self.segment_seconds)
+            if segment != self._segment:
+                self._open_segment(segment)
+            self._files['host'].write(self.HOST_RECORD.pack(
+                timestamp, data['cpu']['usage'], data['gpu']['usage'], memory_percent))
+            # All users for the tick go out in a single write
+            self._files['users'].write(b''.join(self.USER_RECORD.pack(
+                timestamp, self._user_id(user['username']), user['cpu_usage'], user['memory_usage'],
+                user.get('gpu_usage', 0.0), user.get('gpu_memory', 0)) for user in data['users']))
+            for f in self._files.values():
+                f.flush()
+    
+    def _scan(self, kind, record, start, end):
+        """Yield unpacked rows of `kind` with start <= timestamp <= end"""
+        for segment in self._segments(kind):
+            if (end is not None and segment > end) or \
+                    (start is not None and segment + self.segment_seconds <= start):
+                continue
+            with open(self._path(kind, segment), 'rb') as f:
+                count = os.fstat(f.fileno()).st_size // record.size
+                if not count:
+                    continue
+                with mmap.mmap(f.fileno(), count * record.size, access=mmap.ACCESS_READ) as view:
+                    time_at = lambda i: record.unpack_from(view, i * record.size)[0]
+                    first = 0 if start is None else bisect_left(range(count), start, key=time_at)
+                    for i in range(first, count):
+                        row = record.unpack_from(view, i * record.size)
+                        if end is not None and row[0] > end:
+                            break
+                        yield row
+    
+    def query(self, start=None, end=None, usernames=None, resolution=None):
+        """Return archived host and per-user series, averaged into resolution-second buckets
+        
+        Without a resolution, one is picked so the range comes back as at most
+        about ARCHIVE_MAX_POINTS rows per series; short ranges stay raw.
+        """
+        if resolution is None:
+            first = start if start is not None else next(iter(self._segments('host')), None)
+            if first is not None:
+                span = (end if end is not None else time.time()) - first
+                resolution = math.ceil(span / ARCHIVE_MAX_POINTS)
+                if resolution <= 1:
+                    resolution = None
+        with self._lock:
+            user_ids = None
+            if usernames is not None:
+                user_ids = {self._user_ids[name] for name in usernames if name in self._user_ids}
+        
+        host = _BucketedSeries(MetricsHistory.HOST_FIELDS, resolution)
+        for row in self._scan('host', self.HOST_RECORD, start, end):
+            host.add(row[0], row[1:])
+        users = {}
+        for row in self._scan('users', self.USER_RECORD, start, end):
+            if user_ids is not None and row[1] not in user_ids:
+                continue
+            series = users.get(row[1])
+            if series is None:
+                series = users[row[1]] = _BucketedSeries(MetricsHistory.USER_FIELDS, resolution)
+            series.add(row[0], row[2:])
+        # Read names after the scan: a user first seen meanwhile has rows but no earlier name
+        with self._lock:
+            names = list(self._usernames)
+        return {
+            'resolution': resolution or 0,
+            'host': host.result(),
+            'users': {names[user_id]: series.result() for user_id, series in users.items() if user_id < len(names)}
+        }
+
+class _BucketedSeries:
+    """Accumulate rows as columns, averaging into fixed buckets when a resolution is set"""
+    
+    def __init__(self, fields, resolution=None):
+        self.fields = fields
+        self.resolution = resolution
+        self.columns = {'timestamps': []}
+        for field in fields:
+            self.columns[field] = []
+        self._bucket = None
+        self._sums = None
+        self._count = 0
+    
+    def _flush(self):
+        if self._count:
+            self.columns['timestamps'].append(self._bucket)
+            for field, total in zip(self.fields, self._sums):
+                self.columns[field].append(total / self._count)
+    
+    def add(self, timestamp, values):
+        if not self.resolution:
+            self.columns['timestamps'].append(timestamp)
+            for field, value in zip(self.fields, values):
+                self.columns[field].append(value)
+            return
+        bucket = timestamp - timestamp % self.resolution
+        if bucket != self._bucket:
+            self._flush()
+            self._bucket, self._sums, self._count = bucket, list(values), 1
+        else:
+            self._count += 1
+            for i, value in enumerate(values):
+                self._sums[i] += value
+    
+    def result(self):
+        self._flush()
+        self._count = 0
+        return self.columns
+
+def http_connector(url):
+    """(connect, parsed url) for an http:// or https:// URL; connect() opens a new connection
+    
+    Raises ValueError for any other scheme or a URL without a host.
+    """
+    parsed = urlsplit(url)
+    if parsed.scheme == 'https':
+        connection_class, default_port = http.client.HTTPSConnection, 443
+    elif parsed.scheme == 'http':
+        connection_class, default_port = http.client.HTTPConnection, 80
+    else:
+        raise ValueError(f"{url!r}: expected an http:// or https:// URL")
+    if not parsed.hostname:
+        raise ValueError(f"{url!r}: no host")
+    address = (parsed.hostname, parsed.port or default_port)
+    return (lambda: connection_class(*address, timeout=AGENT_TIMEOUT)), parsed
+
+def encode_agent_batch(host, snapshots):
+    """Pack an agent's snapshots into one compressed request body"""
+    batch = {'host': host, 'snapshots': snapshots}
+    return zlib.compress(json.dumps(batch, separators=(',', ':')).encode(), AGENT_COMPRESSION_LEVEL)
+
+def decode_agent_batch(body):
+    """Inverse of encode_agent_batch"""
+    return json.loads(zlib.decompress(body))
+
+# Snapshot keys ClusterRegistry reads from every pushed snapshot, and the per-user fields it sums
+AGENT_SNAPSHOT_KEYS = ('cpu', 'gpu', 'memory', 'users', 'active_user_count')
+AGENT_USER_KEYS = ('username', 'cpu_usage', 'memory_usage', 'gpu_usage', 'gpu_memory', 'io_read_rate',
+                   'io_write_rate')
+
+def agent_snapshot(data):
+    """The part of a snapshot the aggregator reads: host totals and per-user totals, no processes"""
+    return {
+        'cpu': {'usage': data['cpu']['usage']},
+        'gpu': {'usage': data['gpu']['usage']},
+        'memory': {'display': data['memory']['display'], 'total': data['memory']['total']},
+        'active_user_count': data['active_user_count'],
+        'users': [{key: user[key] for key in AGENT_USER_KEYS if key in user} for user in data['users']]
+    }
+
+def check_agent_batch(batch):
+    """Why a decoded batch cannot be ingested, or None when it is well formed"""
+    if not isinstance(batch, dict) or not isinstance(batch.get('host'), str) or not batch['host']:
+        return "expected an object with a non-empty 'host' string"
+    snapshots = batch.get('snapshots')
+    if not isinstance(snapshots, list):
+        return "expected a 'snapshots' list"
+    for snapshot in snapshots:
+        if not isinstance(snapshot, dict) or not all(key in snapshot for key in AGENT_SNAPSHOT_KEYS):
+            return f"every snapshot needs {', '.join(AGENT_SNAPSHOT_KEYS)}"
+    return None
+
+class Agent:
+    """Pushes collected snapshots to a central aggregator
+    
+    The aggregator keeps only each host's newest snapshot, so only the
+    newest one is sent, trimmed by agent_snapshot(), in a compressed POST
+    over a persistent connection. When the aggregator is unreachable sends
+    are retried with exponential backoff and older snapshots are dropped.
+    """
+    
+    def __init__(self, url, host, batch_interval=DEFAULT_SAMPLE_INTERVAL, token=None):
+        self._connect, parsed = http_connector(url)
+        self.host = host
+        self.token = token
+        self.batch_interval = batch_interval
+        self._path = parsed.path.rstrip('/') + '/api/agent/push'
+        self._connection = None
+        self._latest = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+    
+    def enqueue(self, snapshot):
+        """Replace the snapshot waiting for the next send; used as a sampler listener"""
+        latest = agent_snapshot(snapshot.data)
+        with self._lock:
+            self._latest = latest
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _send(self, latest):
+        if self._connection is None:
+            self._connection = self._connect()
+        headers = {'Content-Type': 'application/x-monitor-batch'}
+        if self.token:
+            headers['X-Agent-Token'] = self.token
+        self._connection.request('POST', self._path, body=encode_agent_batch(self.host, [latest]), headers=headers)
+        response = self._connection.getresponse()
+        response.read()
+        if response.status != 200:
+            raise http.client.HTTPException(f"aggregator returned {response.status}")
+    
+    def run(self):
+        """Send the newest snapshot until stop() is called"""
+        backoff = AGENT_MIN_BACKOFF
+        delay = self.batch_interval
+        while not self._stop.wait(delay):
+            with self._lock:
+                latest = self._latest
+                self._latest = None
+            if latest is None:
+                delay = self.batch_interval
+                continue
+            try:
+                self._send(latest)
+            except (OSError, http.client.HTTPException) as e:
+                self_metrics.error('agent_push', f"Error pushing to aggregator, retrying in {backoff:.0f}s: {e}")
+                if self._connection is not None:
+                    self._connection.close()
+                    self._connection = None
+                with self._lock:
+                    # Retry with this snapshot unless a newer one arrived meanwhile
+                    if self._latest is None:
+                        self._latest = latest
+                delay = backoff * random.uniform(1.0, 1.5)
+                backoff = min(backoff * 2, AGENT_MAX_BACKOFF)
+            else:
+                backoff = AGENT_MIN_BACKOFF
+                delay = self.batch_interval
+
+class ClusterRegistry:
+    """Latest snapshot from every agent, merged into per-host and cluster-wide views"""
+    
+    def __init__(self, stale_after=CLUSTER_STALE_SECONDS, forget_after=CLUSTER_FORGET_SECONDS):
+        self.stale_after = stale_after
+        self.forget_after = forget_after
+        self._hosts = {}
+        self._version = 0
+        self._view = None
+        self._lock = threading.Lock()
+    
+    def ingest(self, host, snapshots):
+        """Keep the newest snapshot of a pushed batch; ValueError when it cannot be summarized"""
+        if snapshots:
+            try:
+                self._summarize(host, 0.0, snapshots[-1], 0.0)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                raise ValueError(f"unreadable snapshot: {e!r}") from e
+            with self._lock:
+                self._hosts[host] = (time.time(), snapshots[-1])
+                self._version += 1
+    
+    @staticmethod
+    def _summarize(host, received, data, now):
+        """Host summary and per-user rows of one snapshot; raises on a malformed one"""
+        summary = {
+            'host': host,
+            'cpu_usage': float(data['cpu']['usage']),
+            'gpu_usage': float(data['gpu']['usage']),
+            'memory': str(data['memory']['display']),
+            'active_user_count': int(data['active_user_count']),
+            'age': round(now - received, 1)
+        }
+        # memory_usage is a share of each host's RAM, so totals are kept in GB
+        memory_total = float(data['memory']['total'])
+        users = [(str(user['username']), float(user['cpu_usage']),
+                  float(user['memory_usage']) * memory_total / 100,
+                  float(user.get('gpu_usage', 0.0)), int(user.get('gpu_memory', 0)),
+                  float(user.get('io_read_rate', 0)), float(user.get('io_write_rate', 0)))
+                 for user in data['users']]
+        return summary, users
+    
+    def view(self):
+        """Return the merged cluster view, rebuilt only when an agent has reported"""
+        now = time.time()
+        with self._lock:
+            forgotten = [host for host, (received, _) in self._hosts.items()
+                         if now - received > self.forget_after]
+            for host in forgotten:
+                del self._hosts[host]
+            if forgotten:
+                self._version += 1
+            hosts = dict(self._hosts)
+            version = self._version
+            cached = self._view
+        if cached is not None and cached[0] == version and now - cached[1] < 1.0:
+            return cached[2]
+        
+        host_list = []
+        users = {}
+        for host, (received, data) in sorted(hosts.items()):
+            try:
+                summary, host_users = self._summarize(host, received, data, now)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                self_metrics.error('cluster', f"Dropping malformed snapshot from {host}: {e!r}")
+                with self._lock:
+                    if self._hosts.get(host) == (received, data):
+                        del self._hosts[host]
+                continue
+            stale = now - received > self.stale_after
+            summary['stale'] = stale
+            host_list.append(summary)
+            if stale:
+                continue
+            for username, cpu_usage, memory_gb, gpu_usage, gpu_memory, io_read_rate, io_write_rate in host_users:
+                total = users.setdefault(username, {
+                    'username': username,
+                    'cpu_usage': 0.0,
+                    'memory_gb': 0.0,
+                    'gpu_usage': 0.0,
+                    'gpu_memory': 0,
+                    'io_read_rate': 0,
+                    'io_write_rate': 0,
+                    'hosts': {}
+                })
+                total['cpu_usage'] += cpu_usage
+                total['memory_gb'] += memory_gb
+                total['gpu_usage'] += gpu_usage
+                total['gpu_memory'] += gpu_memory
+                total['io_read_rate'] += io_read_rate
+                total['io_write_rate'] += io_write_rate
+                total['hosts'][host] = round(cpu_usage, 1)
         
-        # System info
-        data = {
-            'cpu': {
-                'usage': cpu_usage,
-                'temperature': get_cpu_temperature()
-            },
-            'gpu': {
-                'usage': gpu_info['usage'],
-                'temperature': gpu_info['temperature']
-            },
-            'memory': {
-                'used': memory_used_gb,
-                'total': memory_total_gb,
-                'display': f"{memory_used_gb:.1f} / {memory_total_gb:.1f} GB"
-            },
-            'users': users,
-            'active_user_count': active_users,
-            'uptime': format_uptime(),
-            'timestamp': datetime.now().isoformat()
+        view = {
+            'hosts': host_list,
+            'users': sorted(users.values(), key=lambda user: user['cpu_usage'], reverse=True)
         }
+        with self._lock:
+            self._view = (version, now, view)
+        return view
+
+# Enabled with --aggregator
+cluster = None
+# Shared secret agents must send with their pushes (--agent-token)
+agent_token = None
+
+def collect_aggregator_data(previous=None):
+    """Collect the local snapshot plus the merged view of all agents"""
+    data = collect_system_data(previous)
+    data['cluster'] = cluster.view()
+    return data
+
+def _celsius(text):
+    """Degrees from a '71.0°C' reading, or None for N/A"""
+    try:
+        return float(text.rstrip('°C'))
+    except (AttributeError, ValueError):
+        return None
+
+# Metrics alert rules can watch: name -> function yielding (key, value) from snapshot data
+ALERT_METRICS = {
+    'host.cpu_usage': lambda data: [('host', data['cpu']['usage'])],
+    'host.cpu_temperature': lambda data: [('host', _celsius(data['cpu']['temperature']))],
+    'host.memory_percent': lambda data: [('host', data['memory']['used'] / data['memory']['total'] * 100
+                                          if data['memory']['total'] else 0.0)],
+    'host.disk_read_rate': lambda data: [('host', data['io']['disk_read_rate'])],
+    'host.disk_write_rate': lambda data: [('host', data['io']['disk_write_rate'])],
+    'host.net_recv_rate': lambda data: [('host', data['io']['net_recv_rate'])],
+    'host.net_sent_rate': lambda data: [('host', data['io']['net_sent_rate'])],
+    'gpu.usage': lambda data: [(f"gpu{gpu['index']}", gpu['usage']) for gpu in data['gpu']['devices']],
+    'gpu.memory_percent': lambda data: [(f"gpu{gpu['index']}", gpu['memory_used'] / gpu['memory_total'] * 100)
+                                        for gpu in data['gpu']['devices'] if gpu['memory_total']],
+    'gpu.temperature': lambda data: [(f"gpu{gpu['index']}", _celsius(gpu['temperature']))
+                                     for gpu in data['gpu']['devices']],
+    'user.cpu_usage': lambda data: [(user['username'], user['cpu_usage']) for user in data['users']],
+    'user.memory_usage': lambda data: [(user['username'], user['memory_usage']) for user in data['users']],
+    'user.gpu_usage': lambda data: [(user['username'], user['gpu_usage']) for user in data['users']],
+    'user.gpu_memory': lambda data: [(user['username'], user['gpu_memory']) for user in data['users']],
+    'user.io_read_rate': lambda data: [(user['username'], user['io_read_rate']) for user in data['users']],
+    'user.io_write_rate': lambda data: [(user['username'], user['io_write_rate']) for user in data['users']]
+}
+
+# A threshold rule: fires for a key once value > above (or < below) has held for `duration`
+# seconds, or with mean=True once the mean over the last `duration` seconds crosses it
+AlertRule = namedtuple('AlertRule', ['name', 'metric', 'above', 'below', 'duration', 'mean'])
+
+def load_alert_rules(path):
+    """Read alert rules from a JSON list of rule objects
+    
+    Each object has a name, a metric from ALERT_METRICS, an "above" or
+    "below" threshold, and optionally "for" (seconds) and "mean". For
+    example {"name": "cpu-hog", "metric": "user.cpu_usage", "above": 800,
+    "for": 600}. An unnamed rule is named after its metric and threshold.
+    Alert state is kept by name, so raises ValueError for duplicate names
+    as well as for an invalid rule.
+    """
+    def is_number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    
+    with open(path) as f:
+        specs = json.load(f)
+    if not isinstance(specs, list):
+        raise ValueError("expected a JSON list of rule objects")
+    rules = []
+    for spec in specs:
+        if not isinstance(spec, dict):
+            raise ValueError(f"rule {spec!r}: expected an object")
+        if 'name' in spec and not isinstance(spec['name'], str):
+            raise ValueError(f"rule {spec['name']!r}: name must be a string")
+        if spec.get('metric') not in ALERT_METRICS:
+            raise ValueError(f"rule {spec.get('name')!r}: metric must be one of {', '.join(sorted(ALERT_METRICS))}")
+        if ('above' in spec) == ('below' in spec):
+            raise ValueError(f"rule {spec.get('name')!r}: give exactly one of above or below")
+        comparison = 'above' if 'above' in spec else 'below'
+        if not is_number(spec[comparison]):
+            raise ValueError(f"rule {spec.get('name')!r}: {comparison} must be a number")
+        if not is_number(spec.get('for', 0)) or spec.get('for', 0) < 0:
+            raise ValueError(f"rule {spec.get('name')!r}: for must be a non-negative number of seconds")
+        name = spec.get('name', f"{spec['metric']} {comparison} {spec[comparison]}")
+        if any(rule.name == name for rule in rules):
+            raise ValueError(f"rule {name!r}: names must be unique")
+        rules.append(AlertRule(name, spec['metric'], spec.get('above'), spec.get('below'),
+                               float(spec.get('for', 0)), bool(spec.get('mean', False))))
+    return rules
+
+class AlertEngine:
+    """Evaluates threshold rules against each snapshot as it is collected
+    
+    State is kept per (rule, key): the time a threshold was first crossed,
+    or for mean rules a window of recent values with a running sum. Each
+    tick costs O(rules x keys) whatever the history length. Firing and
+    resolved events go to every sink; active alerts and recent events ride
+    along in the snapshot, so stream viewers see them without another
+    connection.
+    """
+    
+    def __init__(self, rules, sinks=()):
+        self.rules = list(rules)
+        self.sinks = list(sinks)
+        # (rule name, key) -> [breached since, firing, window deque, window sum]
+        self._state = {}
+        self._active = {}
+        self._recent = deque(maxlen=ALERT_RECENT_EVENTS)
+    
+    def watch(self, collect):
+        """Wrap a sampler collect function so every snapshot is evaluated
         
-        return jsonify(data)
+        A rule that fails to evaluate is counted as an error; the snapshot
+        is still published, with the alerts as they were.
+        """
+        def collect_and_evaluate(previous=None):
+            data = collect() if previous is None else collect(previous)
+            with self_metrics.timed('alerts'):
+                try:
+                    data['alerts'] = self.evaluate(data, time.time())
+                except Exception as e:
+                    self_metrics.error('alerts', f"Error evaluating alert rules: {e!r}")
+                    data['alerts'] = {'active': list(self._active.values()), 'recent': list(self._recent)}
+            return data
+        return collect_and_evaluate
+    
+    def _breached(self, rule, state, value, now):
+        """Update the key's state with a new value; return (rule holds, value compared)"""
+        if rule.mean:
+            window = state[2]
+            window.append((now, value))
+            state[3] += value
+            while window[0][0] < now - rule.duration:
+                state[3] -= window.popleft()[1]
+            if state[0] is None:
+                state[0] = now
+            value = state[3] / len(window)
+            if now - state[0] < rule.duration:
+                # The window is not covered yet
+                return False, value
+        return (value > rule.above if rule.above is not None else value < rule.below), value
+    
+    def evaluate(self, data, now):
+        """Advance every rule by one snapshot; return the active alerts and recent events"""
+        for rule in self.rules:
+            seen = set()
+            for key, value in ALERT_METRICS[rule.metric](data):
+                if value is None:
+                    continue
+                seen.add(key)
+                state = self._state.get((rule.name, key))
+                if state is None:
+                    state = self._state[(rule.name, key)] = [None, False, deque(), 0.0]
+                breached, value = self._breached(rule, state, value, now)
+                if breached:
+                    if not rule.mean and state[0] is None:
+                        state[0] = now
+                    if not state[1] and (rule.mean or now - state[0] >= rule.duration):
+                        state[1] = True
+                        self._notify(rule, key, 'firing', value, state[0], now)
+                else:
+                    if state[1]:
+                        state[1] = False
+                        self._notify(rule, key, 'resolved', value, state[0], now)
+                    if not rule.mean:
+                        state[0] = None
+            # Keys that disappeared (a user logged out) resolve and drop their state
+            for state_key in [k for k in self._state if k[0] == rule.name and k[1] not in seen]:
+                state = self._state.pop(state_key)
+                if state[1]:
+                    self._notify(rule, state_key[1], 'resolved', None, state[0], now)
+        return {'active': list(self._active.values()), 'recent': list(self._recent)}
+    
+    def _notify(self, rule, key, status, value, since, now):
+        threshold = rule.above if rule.above is not None else rule.below
+        comparison = 'above' if rule.above is not None else 'below'
+        value = round(value, 1) if value is not None else None
+        event = {
+            'rule': rule.name,
+            'metric': rule.metric,
+            'key': key,
+            'state': status,
+            'value': value,
+            'threshold': threshold,
+            'since': round(since, 1) if since is not None else None,
+            'at': round(now, 1),
+            'host': HOSTNAME,
+            'message': (f"{rule.name}: {rule.metric} for {key} is {value} ({comparison} {threshold})"
+                        if status == 'firing' else f"{rule.name}: {rule.metric} for {key} resolved")
+        }
+        if status == 'firing':
+            self._active[(rule.name, key)] = event
+        else:
+            self._active.pop((rule.name, key), None)
+        self._recent.append(event)
+        for sink in self.sinks:
+            try:
+                sink(event)
+            except Exception as e:
+                self_metrics.error('alert_sink', f"Error in alert sink {sink!r}: {e}")
+
+class LogFileSink:
+    """Alert sink appending each event to a file as a JSON line"""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def __call__(self, event):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+class WebhookSink:
+    """Alert sink POSTing each event as JSON to a URL from a background thread
+    
+    The sampler never waits on the webhook; if it falls behind only the
+    newest ALERT_WEBHOOK_QUEUE events are kept.
+    """
+    
+    def __init__(self, url, max_queue=ALERT_WEBHOOK_QUEUE):
+        self._connect, parsed = http_connector(url)
+        self._path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+        self._queue = deque(maxlen=max_queue)
+        self._pending = threading.Event()
+        threading.Thread(target=self._run, name='alert-webhook', daemon=True).start()
+    
+    def __call__(self, event):
+        self._queue.append(event)
+        self._pending.set()
+    
+    def _run(self):
+        while True:
+            self._pending.wait()
+            self._pending.clear()
+            while self._queue:
+                event = self._queue.popleft()
+                connection = self._connect()
+                try:
+                    connection.request('POST', self._path, body=json.dumps(event),
+                                       headers={'Content-Type': 'application/json'})
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status >= 300:
+                        raise http.client.HTTPException(f"webhook returned {response.status}")
+                except (OSError, http.client.HTTPException) as e:
+                    self_metrics.error('alert_webhook', f"Error posting alert to webhook: {e}")
+                finally:
+                    connection.close()
+
+class UsageLedger:
+    """Per-user CPU-seconds, GPU-seconds and memory GB-hours integrated over time
+    
+    Each snapshot adds usage x elapsed time to the open hourly bucket, so a
+    report only sums at most one bucket per hour in the window and never
+    looks at raw samples. With a persistence file, closed buckets are
+    appended to it as JSON lines and the open bucket is checkpointed next to
+    it, so a restart loses at most USAGE_CHECKPOINT_SECONDS of usage. The
+    file is rewritten without expired buckets on load and once a day.
+    """
+    
+    def __init__(self, bucket_seconds=USAGE_BUCKET_SECONDS, retention=USAGE_RETENTION):
+        self.bucket_seconds = bucket_seconds
+        self.retention = retention
+        self.path = None
+        # (bucket start, {username: [cpu_seconds, gpu_seconds, memory_gb_hours]}), oldest first
+        self._buckets = deque()
+        self._last_timestamp = None
+        self._file_start = None
+        self._checkpointed = 0.0
+        self._lock = threading.Lock()
+    
+    def persist_to(self, path):
+        """Load buckets from path and its checkpoint, then keep both up to date"""
+        now = time.time()
+        horizon = now - self.retention
+        buckets = {}
+        rewrite = False
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        rewrite = True
+                        continue
+                    if entry['start'] >= horizon:
+                        buckets[entry['start']] = entry['users']
+                    else:
+                        rewrite = True
         
-    except Exception as e:
-        print(f"Error in system_data: {e}")
-        return jsonify({'error': str(e)}), 500
+        open_bucket = None
+        try:
+            with open(path + '.open') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            entry = None
+        if entry is not None and entry['start'] not in buckets and entry['start'] >= horizon:
+            if entry['start'] == now // self.bucket_seconds * self.bucket_seconds:
+                open_bucket = (entry['start'], entry['users'])
+            else:
+                # The server stopped before this bucket closed
+                buckets[entry['start']] = entry['users']
+                rewrite = True
+        
+        closed = sorted(buckets.items())
+        with self._lock:
+            self.path = path
+            self._file_start = closed[0][0] if closed else None
+            self._buckets.extendleft(reversed(closed))
+            if open_bucket is not None and (not self._buckets or self._buckets[-1][0] < open_bucket[0]):
+                self._buckets.append(open_bucket)
+            if rewrite:
+                self._rewrite(closed)
+    
+    def _close(self, bucket):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'start': bucket[0], 'users': bucket[1]}) + '\n')
+        except OSError as e:
+            self_metrics.error('usage', f"Error saving usage bucket: {e}")
+        if self._file_start is None:
+            self._file_start = bucket[0]
+    
+    def _rewrite(self, buckets):
+        """Replace the persistence file with just the given closed buckets"""
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                for start, users in buckets:
+                    f.write(json.dumps({'start': start, 'users': users}) + '\n')
+            os.replace(temporary, self.path)
+        except OSError as e:
+            self_metrics.error('usage', f"Error rewriting usage file: {e}")
+            return
+        self._file_start = buckets[0][0] if buckets else None
+    
+    def _checkpoint(self):
+        if self.path is None or not self._buckets:
+            return
+        start, users = self._buckets[-1]
+        temporary = self.path + '.open.tmp'
+        try:
+            with open(temporary, 'w') as f:
+                json.dump({'start': start, 'users': users}, f)
+            os.replace(temporary, self.path + '.open')
+        except OSError as e:
+            self_metrics.error('usage', f"Error checkpointing usage bucket: {e}")
+        self._checkpointed = time.time()
+    
+    def checkpoint(self):
+        """Save the open bucket for the next start; called periodically and at exit"""
+        with self._lock:
+            self._checkpoint()
+    
+    def record(self, snapshot):
+        """Integrate one snapshot; used as a sampler listener"""
+        timestamp = snapshot.collected_at
+        data = snapshot.data
+        with self._lock:
+            last, self._last_timestamp = self._last_timestamp, timestamp
+            if last is None or timestamp <= last:
+                return
+            # Values describe the interval ending at this snapshot; a long gap
+            # (suspend, stalled sampler) is only credited up to USAGE_MAX_GAP
+            elapsed = min(timestamp - last, USAGE_MAX_GAP)
+            start = int(timestamp // self.bucket_seconds * self.bucket_seconds)
+            if not self._buckets or self._buckets[-1][0] != start:
+                if self._buckets:
+                    self._close(self._buckets[-1])
+                self._buckets.append((start, {}))
+                while self._buckets[0][0] < start - self.retention:
+                    self._buckets.popleft()
+                if self._file_start is not None and self._file_start < self._buckets[0][0] - 86400:
+                    # Drop a day's worth of expired buckets from the file
+                    self._rewrite(list(self._buckets)[:-1])
+            totals = self._buckets[-1][1]
+            memory_total = data['memory']['total']
+            for user in data['users']:
+                entry = totals.get(user['username'])
+                if entry is None:
+                    entry = totals[user['username']] = [0.0, 0.0, 0.0]
+                entry[0] += user['cpu_usage'] / 100 * elapsed
+                entry[1] += user.get('gpu_usage', 0.0) / 100 * elapsed
+                entry[2] += user['memory_usage'] / 100 * memory_total * elapsed / 3600
+            if time.time() - self._checkpointed >= USAGE_CHECKPOINT_SECONDS:
+                self._checkpoint()
+    
+    def report(self, start, end=None):
+        """Per-user totals for buckets starting in [start, end), with each user's share of CPU and GPU"""
+        start = int(start // self.bucket_seconds * self.bucket_seconds)
+        with self._lock:
+            buckets = [bucket for bucket in self._buckets
+                       if bucket[0] >= start and (end is None or bucket[0] < end)]
+            totals = defaultdict(lambda: [0.0, 0.0, 0.0])
+            for _, users in buckets:
+                for username, (cpu, gpu, memory) in users.items():
+                    entry = totals[username]
+                    entry[0] += cpu
+                    entry[1] += gpu
+                    entry[2] += memory
+        cpu_total = sum(entry[0] for entry in totals.values())
+        gpu_total = sum(entry[1] for entry in totals.values())
+        users = [{
+            'username': username,
+            'cpu_hours': round(cpu / 3600, 3),
+            'gpu_hours': round(gpu / 3600, 3),
+            'memory_gb_hours': round(memory, 3),
+            'cpu_share': round(cpu / cpu_total * 100, 2) if cpu_total else 0.0,
+            'gpu_share': round(gpu / gpu_total * 100, 2) if gpu_total else 0.0
+        } for username, (cpu, gpu, memory) in totals.items()]
+        users.sort(key=lambda user: user['cpu_hours'], reverse=True)
+        return {
+            'start': buckets[0][0] if buckets else start,
+            'end': end if end is not None else time.time(),
+            'bucket_seconds': self.bucket_seconds,
+            'users': users
+        }
+
+sampler = Sampler()
+history = MetricsHistory()
+sampler.add_listener(history.record)
+usage = UsageLedger()
+sampler.add_listener(usage.record)
+# Enabled with --archive-dir
+archive = None
+
+@app.route('/api/system-data')
+def system_data():
+    """API endpoint for system data
+    
+    With ?since=<seq> the response is a versioned update holding only what
+    changed since that snapshot, or a full resync if it is no longer retained.
+    
+    The users list can be narrowed with ?user= (repeatable), ?sort=, ?top=
+    (processes per user), ?page=/?limit= and ?min_cpu=/?min_memory_mb=.
+    """
+    try:
+        query = parse_user_query(request.args.to_dict(flat=False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    snapshot = sampler.latest(timeout=SNAPSHOT_WAIT_TIMEOUT)
+    if snapshot is None:
+        return jsonify({'error': 'No system data collected yet'}), 503
+    since = request.args.get('since', type=int)
+    body = sampler.response_body(snapshot, since, query)
+    status, content, headers = cached_body_response(
+        body, request.headers.get('If-None-Match'), request.headers.get('Accept-Encoding'))
+    return Response(content, status=status, headers=headers, mimetype='application/json')
+
+@app.route('/api/jobs/<int:pid>')
+def job_members(pid):
+    """Processes making up the job rooted at pid, in tree order, from the latest scan"""
+    job = job_table.members(pid)
+    if job is None:
+        return jsonify({'error': 'No multi-process job with that pid in the latest scan'}), 404
+    username, processes = job
+    return jsonify({'pid': pid, 'username': username, 'processes': processes})
+
+def parse_history_args(args):
+    """(start, end, usernames, resolution) from /api/history-style query args
+    
+    ?seconds= looks back from end (or now). Raises ValueError for a
+    non-finite start or end, or a non-positive seconds or resolution.
+    """
+    start = args.get('start', type=float)
+    end = args.get('end', type=float)
+    seconds = args.get('seconds', type=float)
+    resolution = args.get('resolution', type=float)
+    for name, value in (('start', start), ('end', end)):
+        if value is not None and not math.isfinite(value):
+            raise ValueError(f'{name} must be a finite epoch time')
+    for name, value in (('seconds', seconds), ('resolution', resolution)):
+        if value is not None and not (value > 0 and math.isfinite(value)):
+            raise ValueError(f'{name} must be a positive number of seconds')
+    if seconds is not None:
+        start = (end or time.time()) - seconds
+    return start, end, args.getlist('user') or None, resolution
+
+@app.route('/api/history')
+def system_history():
+    """Host and per-user history, by ?start=/&end= epoch seconds or ?seconds= look-back
+    
+    Repeat ?user= to select users; an empty ?user= returns host metrics only.
+    ?resolution= (seconds) serves the coarsest rollup tier at least that fine;
+    without it the finest tier still covering the range is used.
+    """
+    try:
+        start, end, usernames, resolution = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(history.query(start, end, usernames, resolution))
+
+@app.route('/api/archive')
+def system_archive():
+    """Archived history that survives restarts; same parameters as /api/history
+    
+    Without ?resolution= long ranges are averaged down to about
+    ARCHIVE_MAX_POINTS rows per series rather than returned raw.
+    """
+    if archive is None:
+        return jsonify({'error': 'Archiving is not enabled (start with --archive-dir)'}), 404
+    try:
+        start, end, usernames, resolution = parse_history_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(archive.query(start, end, usernames, resolution))
+
+@app.route('/api/usage-report')
+def usage_report():
+    """Per-user CPU-hours, GPU-hours and memory GB-hours for fair-share accounting
+    
+    ?period=day|week|month looks back from now, or ?start=/&end= give epoch
+    seconds; the window is aligned to whole buckets. ?format=csv downloads
+    the table instead of JSON.
+    """
+    period = request.args.get('period', 'day')
+    if period not in USAGE_PERIODS:
+        return jsonify({'error': f"period must be one of {', '.join(USAGE_PERIODS)}"}), 400
+    end = request.args.get('end', type=float)
+    start = request.args.get('start', type=float)
+    for name, value in (('start', start), ('end', end)):
+        if value is not None and not 0 <= value <= USAGE_MAX_TIMESTAMP:
+            return jsonify({'error': f'{name} must be an epoch time between 0 and {USAGE_MAX_TIMESTAMP}'}), 400
+    if start is None:
+        start = max(0, (end or time.time()) - USAGE_PERIODS[period])
+    report = usage.report(start, end)
+    report['period'] = period
+    if request.args.get('format') != 'csv':
+        return jsonify(report)
+    
+    out = io.StringIO()
+    writer = csv.writer(out)
+    columns = ['username', 'cpu_hours', 'gpu_hours', 'memory_gb_hours', 'cpu_share', 'gpu_share']
+    writer.writerow(columns)
+    for user in report['users']:
+        writer.writerow([user[column] for column in columns])
+    day = datetime.fromtimestamp(report['start']).strftime('%Y-%m-%d')
+    return Response(out.getvalue(), mimetype='text/csv', headers={
+        'Content-Disposition': f'attachment; filename="usage-{period}-{day}.csv"'})
+
+@app.route('/api/agent/push', methods=['POST'])
+def agent_push():
+    """Receive a compressed batch of snapshots from an agent"""
+    if cluster is None:
+        return jsonify({'error': 'Not running as an aggregator (start with --aggregator)'}), 404
+    if agent_token and not hmac.compare_digest(request.headers.get('X-Agent-Token', '').encode(),
+                                               agent_token.encode()):
+        return jsonify({'error': 'Missing or wrong agent token'}), 403
+    try:
+        batch = decode_agent_batch(request.get_data())
+    except (zlib.error, ValueError) as e:
+        return jsonify({'error': f'Bad agent batch: {e}'}), 400
+    problem = check_agent_batch(batch)
+    if problem:
+        return jsonify({'error': f'Bad agent batch: {problem}'}), 400
+    try:
+        cluster.ingest(batch['host'], batch['snapshots'])
+    except ValueError as e:
+        return jsonify({'error': f'Bad agent batch: {e}'}), 400
+    return jsonify({'received': len(batch['snapshots'])})
+
+@app.route('/api/cluster')
+def cluster_view():
+    """Per-host summaries and cluster-wide per-user totals"""
+    if cluster is None:
+        return jsonify({'error': 'Not running as an aggregator (start with --aggregator)'}), 404
+    return jsonify(cluster.view())
+
+@app.route('/api/stream')
+def system_stream():
+    """Server-Sent Events stream pushing a full snapshot, then deltas
+    
+    Accepts the same users query parameters as system_data().
+    """
+    try:
+        query = parse_user_query(request.args.to_dict(flat=False))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    def events():
+        sampler.subscribe()
+        try:
+            last_seq = last_event_id
+            while True:
+                snapshot = sampler.wait_for_update(last_seq, timeout=STREAM_KEEPALIVE)
+                if snapshot is None or snapshot.seq == last_seq:
+                    # Comment lines keep proxies from closing an idle stream
+                    yield ': keepalive\n\n'
+                    continue
+                payload = sampler.update_payload(snapshot, last_seq, query)
+                last_seq = snapshot.seq
+                yield f'id: {event_id(snapshot.seq)}\ndata: {payload}\n\n'
+        finally:
+            sampler.unsubscribe()
+    
+    # A reconnecting EventSource resumes from the last id it saw; ids from before a
+    # restart name another instance's snapshots and start over with a full one
+    last_event_id = parse_event_id(request.headers.get('Last-Event-ID'))
+    
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers=headers)
+
+# (name, help) of the gauges rendered from the latest snapshot
+SNAPSHOT_METRICS = (
+    ('system_monitor_cpu_usage_percent', 'CPU utilisation across all cores'),
+    ('system_monitor_cpu_core_usage_percent', 'CPU utilisation per core'),
+    ('system_monitor_memory_used_bytes', 'Memory in use'),
+    ('system_monitor_memory_total_bytes', 'Installed memory'),
+    ('system_monitor_disk_read_bytes_per_second', 'Host disk reads'),
+    ('system_monitor_disk_write_bytes_per_second', 'Host disk writes'),
+    ('system_monitor_network_receive_bytes_per_second', 'Host network receive, excluding loopback'),
+    ('system_monitor_network_transmit_bytes_per_second', 'Host network transmit, excluding loopback'),
+    ('system_monitor_gpu_usage_percent', 'GPU utilisation per device'),
+    ('system_monitor_gpu_memory_used_bytes', 'GPU memory in use per device'),
+    ('system_monitor_gpu_memory_total_bytes', 'GPU memory per device'),
+    ('system_monitor_gpu_temperature_celsius', 'GPU temperature per device'),
+    ('system_monitor_active_users', 'Users with significant usage'),
+    ('system_monitor_user_cpu_percent', 'CPU use per user (100 = one core)'),
+    ('system_monitor_user_memory_percent', 'Share of memory used per user'),
+    ('system_monitor_user_gpu_percent', 'GPU utilisation attributed to each user'),
+    ('system_monitor_user_gpu_memory_bytes', 'GPU memory held per user'),
+    ('system_monitor_user_disk_read_bytes_per_second', 'Disk reads per user'),
+    ('system_monitor_user_disk_write_bytes_per_second', 'Disk writes per user'),
+    ('system_monitor_user_processes', 'Listed jobs per user'),
+    ('system_monitor_alerts_firing', 'Keys each alert rule is currently firing for')
+)
+
+def _snapshot_samples(data):
+    """Yield (metric name, labels, value) for the host and per-user values in data"""
+    yield 'system_monitor_cpu_usage_percent', '', data['cpu']['usage']
+    for core, usage in enumerate(data['cpu']['per_core']):
+        yield 'system_monitor_cpu_core_usage_percent', f'core="{core}"', usage
+    yield 'system_monitor_memory_used_bytes', '', round(data['memory']['used'] * 1024**3)
+    yield 'system_monitor_memory_total_bytes', '', round(data['memory']['total'] * 1024**3)
+    yield 'system_monitor_disk_read_bytes_per_second', '', data['io']['disk_read_rate']
+    yield 'system_monitor_disk_write_bytes_per_second', '', data['io']['disk_write_rate']
+    yield 'system_monitor_network_receive_bytes_per_second', '', data['io']['net_recv_rate']
+    yield 'system_monitor_network_transmit_bytes_per_second', '', data['io']['net_sent_rate']
+    for gpu in data['gpu']['devices']:
+        labels = f'gpu="{gpu["index"]}",name="{_metric_label(gpu["name"])}"'
+        yield 'system_monitor_gpu_usage_percent', labels, gpu['usage']
+        yield 'system_monitor_gpu_memory_used_bytes', labels, gpu['memory_used'] * MB
+        yield 'system_monitor_gpu_memory_total_bytes', labels, gpu['memory_total'] * MB
+        if gpu['temperature'] != "N/A":
+            yield 'system_monitor_gpu_temperature_celsius', labels, gpu['temperature'].rstrip('°C')
+    yield 'system_monitor_active_users', '', data['active_user_count']
+    for user in data['users']:
+        labels = f'user="{_metric_label(user["username"])}"'
+        yield 'system_monitor_user_cpu_percent', labels, round(user['cpu_usage'], 2)
+        yield 'system_monitor_user_memory_percent', labels, round(user['memory_usage'], 3)
+        yield 'system_monitor_user_gpu_percent', labels, user['gpu_usage']
+        yield 'system_monitor_user_gpu_memory_bytes', labels, user['gpu_memory'] * MB
+        yield 'system_monitor_user_disk_read_bytes_per_second', labels, user['io_read_rate']
+        yield 'system_monitor_user_disk_write_bytes_per_second', labels, user['io_write_rate']
+        yield 'system_monitor_user_processes', labels, user['process_count']
+    if 'alerts' in data:
+        firing = defaultdict(int)
+        for alert in data['alerts']['active']:
+            firing[alert['rule']] += 1
+        for rule, count in sorted(firing.items()):
+            yield 'system_monitor_alerts_firing', f'rule="{_metric_label(rule)}"', count
+
+def render_metrics():
+    """Prometheus text exposition of the latest snapshot and the monitor's own metrics"""
+    lines = []
+    snapshot = sampler.current
+    if snapshot is not None:
+        samples = defaultdict(list)
+        for name, labels, value in _snapshot_samples(snapshot.data):
+            samples[name].append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        for name, help_text in SNAPSHOT_METRICS:
+            if samples[name]:
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge'] + samples[name]
+    
+    monitor = [
+        ('system_monitor_snapshot_seq', 'counter', 'Snapshots published', snapshot.seq if snapshot else 0),
+        ('system_monitor_snapshot_age_seconds', 'gauge', 'Seconds since the latest snapshot',
+         round(time.time() - snapshot.collected_at, 3) if snapshot else 0),
+        ('system_monitor_process_table_size', 'gauge', 'Processes tracked by the process table', len(process_table)),
+        ('system_monitor_stream_subscribers', 'gauge', 'Connected push-stream viewers', sampler.subscribers),
+        ('system_monitor_scan_interval_seconds', 'gauge', 'Current seconds between process scans',
+         sampler.effective_scan_interval)
+    ]
+    for name, kind, help_text, value in monitor:
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}', f'{name} {value}']
+    lines += self_metrics.render()
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.after_request
+def count_request(response):
+    """Count each response Flask serves in the /metrics request totals"""
+    rule = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    self_metrics.request(rule, request.method, response.status_code)
+    return response
+
+class AsyncSnapshotHub:
+    """Wakes asyncio stream handlers when the sampler thread publishes"""
+    
+    def __init__(self, sampler):
+        self.sampler = sampler
+        self.loop = None
+        self._published = None
+    
+    def attach(self, loop):
+        """Bind to the serving event loop; call once from inside it"""
+        self.loop = loop
+        self._published = asyncio.Event()
+        self.sampler.add_listener(self._on_snapshot)
+    
+    def _on_snapshot(self, snapshot):
+        # Runs in the sampler thread
+        self.loop.call_soon_threadsafe(self._wake)
+    
+    def _wake(self):
+        published, self._published = self._published, asyncio.Event()
+        published.set()
+    
+    async def wait_for_update(self, after_seq, timeout):
+        """Await a snapshot newer than after_seq without blocking the loop"""
+        deadline = self.loop.time() + timeout
+        snapshot = self.sampler.current
+        while snapshot is None or snapshot.seq <= after_seq:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._published.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            snapshot = self.sampler.current
+        return snapshot
+
+async_hub = AsyncSnapshotHub(sampler)
+
+async def _asgi_respond(send, status, body, content_type='application/json', headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()),
+                    (b'content-length', str(len(body)).encode())] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+def _asgi_query(scope):
+    return parse_qs(scope.get('query_string', b'').decode())
+
+def _asgi_header(scope, name):
+    for key, value in scope.get('headers', ()):
+        if key == name:
+            return value.decode()
+    return None
+
+async def _asgi_cached(scope, send, body, content_type, cache_control='no-cache'):
+    status, content, headers = cached_body_response(
+        body, _asgi_header(scope, b'if-none-match'), _asgi_header(scope, b'accept-encoding'), cache_control)
+    await _asgi_respond(send, status, content, content_type,
+                        headers=[(name.lower().encode(), value.encode()) for name, value in headers])
+
+async def asgi_index(scope, receive, send):
+    """Async counterpart of index()"""
+    await _asgi_cached(scope, send, index_page, 'text/html; charset=utf-8')
+
+async def asgi_static_asset(scope, receive, send):
+    """Async counterpart of static_asset()"""
+    asset = STATIC_ASSETS.get(scope['path'][len('/assets/'):])
+    if asset is None:
+        await _asgi_respond(send, 404, b'{"error": "Not found"}')
+        return
+    content_type, body = asset
+    await _asgi_cached(scope, send, body, content_type, ASSET_CACHE_CONTROL)
+
+async def asgi_system_data(scope, receive, send):
+    """Async counterpart of system_data()"""
+    snapshot = sampler.current
+    if snapshot is None:
+        snapshot = await async_hub.wait_for_update(0, SNAPSHOT_WAIT_TIMEOUT)
+    if snapshot is None:
+        await _asgi_respond(send, 503, b'{"error": "No system data collected yet"}')
+        return
+    args = _asgi_query(scope)
+    try:
+        query = parse_user_query(args)
+    except ValueError as e:
+        await _asgi_respond(send, 400, json.dumps({'error': str(e)}).encode())
+        return
+    try:
+        since = int(args['since'][0]) if args.get('since') else None
+    except ValueError:
+        since = None
+    body = sampler.response_body(snapshot, since, query)
+    await _asgi_cached(scope, send, body, 'application/json')
+
+async def asgi_stream(scope, receive, send):
+    """Async counterpart of system_stream(); each viewer is one coroutine"""
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+    
+    try:
+        query = parse_user_query(_asgi_query(scope))
+    except ValueError as e:
+        await _asgi_respond(send, 400, json.dumps({'error': str(e)}).encode())
+        return
+    last_seq = parse_event_id(_asgi_header(scope, b'last-event-id'))
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [(b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no')]
+    })
+    disconnected = asyncio.ensure_future(wait_for_disconnect())
+    sampler.subscribe()
+    try:
+        while not disconnected.done():
+            snapshot = await async_hub.wait_for_update(last_seq, STREAM_KEEPALIVE)
+            if snapshot is None or snapshot.seq == last_seq:
+                body = b': keepalive\n\n'
+            else:
+                payload = sampler.update_payload(snapshot, last_seq, query)
+                last_seq = snapshot.seq
+                body = f'id: {event_id(snapshot.seq)}\ndata: {payload}\n\n'.encode()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+    except OSError:
+        pass
+    finally:
+        sampler.unsubscribe()
+        disconnected.cancel()
+
+async def asgi_wsgi_fallback(scope, receive, send):
+    """Run any other route through the Flask app in the default executor"""
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', ''),
+        'PATH_INFO': scope['path'],
+        'QUERY_STRING': scope.get('query_string', b'').decode(),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('', 0))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for key, value in scope.get('headers', ()):
+        name = key.decode().upper().replace('-', '_')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value.decode()
+        elif name != 'CONTENT_LENGTH':
+            environ[f'HTTP_{name}'] = value.decode()
+    
+    started = {}
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = [(k.lower().encode(), v.encode()) for k, v in headers]
+    
+    def run_wsgi():
+        result = app(environ, start_response)
+        try:
+            return b''.join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+    
+    payload = await asyncio.get_running_loop().run_in_executor(None, run_wsgi)
+    await send({'type': 'http.response.start', 'status': started['status'], 'headers': started['headers']})
+    await send({'type': 'http.response.body', 'body': payload})
+
+# Routes served natively by the ASGI app; everything else goes through Flask
+ASGI_ROUTES = {
+    '/': asgi_index,
+    '/api/system-data': asgi_system_data,
+    '/api/stream': asgi_stream
+}
+
+async def asgi_app(scope, receive, send):
+    """ASGI entry point for serving with an asyncio server such as uvicorn"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                async_hub.attach(asyncio.get_running_loop())
+                sampler.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                sampler.stop(timeout=5)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    if scope['path'].startswith('/assets/'):
+        route, handler = '/assets/<name>', asgi_static_asset
+    else:
+        route = scope['path']
+        handler = ASGI_ROUTES.get(route)
+    if handler is None:
+        # Flask counts the requests it serves itself
+        await asgi_wsgi_fallback(scope, receive, send)
+        return
+    
+    async def counted_send(message):
+        if message['type'] == 'http.response.start':
+            self_metrics.request(route, scope['method'], message['status'])
+        await send(message)
+    await handler(scope, receive, counted_send)
 
 if __name__ == '__main__':
-    import socket
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--interval', type=float, default=DEFAULT_SAMPLE_INTERVAL,
+                        help='seconds between host-level samples')
+    parser.add_argument('--scan-interval', type=float, default=DEFAULT_SCAN_INTERVAL,
+                        help='minimum seconds between process and GPU scans')
+    parser.add_argument('--cpu-budget', type=float, default=DEFAULT_CPU_BUDGET * 100,
+                        help='percent of one core the monitor may use before scans are slowed down')
+    parser.add_argument('--idle-interval', type=float, default=IDLE_SAMPLE_INTERVAL,
+                        help='seconds between samples while nobody is watching')
+    parser.add_argument('--min-process-cpu', type=float, default=PROCESS_MIN_CPU,
+                        help='list processes using more than this CPU percent')
+    parser.add_argument('--min-process-memory', type=float, default=PROCESS_MIN_MEMORY_MB,
+                        help='list processes using more than this many MB of RAM')
+    parser.add_argument('--min-process-io', type=float, default=PROCESS_MIN_IO_RATE / MB,
+                        help='list processes doing more than this many MB/s of disk I/O')
+    parser.add_argument('--process-backend', choices=sorted(PROCESS_BACKENDS), default='psutil',
+                        help='how to scan the process table (procfs reads /proc directly, Linux only)')
+    parser.add_argument('--user-accounting', choices=['auto', 'cgroup', 'processes'], default='auto',
+                        help='per-user totals from systemd user slices (cgroup v2) or by summing '
+                             'listed processes (auto uses cgroups when user slices exist)')
+    parser.add_argument('--gpu-backend', choices=['auto'] + sorted(GPU_BACKENDS), default='auto',
+                        help='how to query NVIDIA GPUs (auto tries NVML, then nvidia-smi)')
+    parser.add_argument('--agent', metavar='URL',
+                        help='run only the collector and push snapshots to the aggregator at URL')
+    parser.add_argument('--agent-name', default=HOSTNAME,
+                        help='host name reported by this agent')
+    parser.add_argument('--aggregator', action='store_true',
+                        help='accept pushes from agents and serve a cluster-wide view')
+    parser.add_argument('--agent-token', default=os.environ.get('MONITOR_AGENT_TOKEN'),
+                        help='shared secret agents send and the aggregator requires '
+                             '(default: $MONITOR_AGENT_TOKEN)')
+    parser.add_argument('--alert-rules', metavar='PATH',
+                        help='JSON list of alert rules, e.g. [{"name": "cpu-hog", "metric": "user.cpu_usage", '
+                             '"above": 800, "for": 600}]')
+    parser.add_argument('--alert-log', metavar='PATH',
+                        help='append alert events to this file as JSON lines')
+    parser.add_argument('--alert-webhook', metavar='URL',
+                        help='POST alert events as JSON to this URL')
+    parser.add_argument('--port', type=int, default=5000,
+                        help='port to serve the dashboard on')
+    parser.add_argument('--server', choices=['flask', 'asgi'], default='flask',
+                        help='flask uses the threaded development server; asgi serves asgi_app '
+                             'with uvicorn so thousands of stream viewers share one event loop')
+    parser.add_argument('--archive-dir',
+                        help='persist history to segment files in this directory')
+    parser.add_argument('--archive-retention-days', type=float, default=ARCHIVE_RETENTION / 86400,
+                        help='days of archived history to keep')
+    parser.add_argument('--history-max-users', type=int, default=HISTORY_MAX_USERS,
+                        help='users given their own in-memory history (about 0.7 MB each when full)')
+    args = parser.parse_args()
+    
+    sampler.interval = args.interval
+    sampler.scan_interval = sampler.effective_scan_interval = max(args.interval, args.scan_interval)
+    sampler.cpu_budget = args.cpu_budget / 100
+    sampler.idle_interval = args.idle_interval
+    history.max_users = args.history_max_users
+    PROCESS_MIN_CPU = args.min_process_cpu
+    PROCESS_MIN_MEMORY_MB = args.min_process_memory
+    PROCESS_MIN_IO_RATE = args.min_process_io * MB
+    process_table = PROCESS_BACKENDS[args.process_backend]()
+    gpu_backend = make_gpu_backend(args.gpu_backend)
+    user_accounting = make_user_accounting(args.user_accounting)
+    
+    if args.aggregator:
+        cluster = ClusterRegistry()
+        agent_token = args.agent_token
+        sampler.collect = collect_aggregator_data
+    
+    if args.alert_rules:
+        try:
+            rules = load_alert_rules(args.alert_rules)
+        except (OSError, ValueError) as e:
+            parser.error(f"--alert-rules: {e}")
+        sinks = []
+        if args.alert_log:
+            sinks.append(LogFileSink(args.alert_log))
+        if args.alert_webhook:
+            try:
+                sinks.append(WebhookSink(args.alert_webhook))
+            except ValueError as e:
+                parser.error(f"--alert-webhook: {e}")
+        sampler.collect = AlertEngine(rules, sinks).watch(sampler.collect)
+    
+    if args.agent:
+        # Agents only collect and push; the aggregator serves the dashboard
+        try:
+            agent = Agent(args.agent, args.agent_name, batch_interval=args.interval, token=args.agent_token)
+        except ValueError as e:
+            parser.error(f"--agent: {e}")
+        # The aggregator's viewers are not visible here, so never back off
+        sampler.idle_interval = args.interval
+        # Nothing serves history or usage reports here, so do not keep them
+        sampler.remove_listener(history.record)
+        sampler.remove_listener(usage.record)
+        sampler.add_listener(agent.enqueue)
+        sampler.start()
+        print(f"Pushing snapshots from {args.agent_name} to {args.agent} every {args.interval}s")
+        try:
+            agent.run()
+        except KeyboardInterrupt:
+            pass
+        raise SystemExit(0)
     
     # Get local IP address
     s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         s.connect(('8.8.8.8', 80))
         local_ip = s.getsockname()[0]
-    except:
+    except OSError:
         local_ip = '127.0.0.1'
     finally:
         s.close()
     
     print(f"Starting Multi-User System Monitor Server...")
-    print(f"Local access: http://localhost:5000")
-    print(f"VPN access: http://{local_ip}:5000")
+    print(f"Local access: http://localhost:{args.port}")
+    print(f"VPN access: http://{local_ip}:{args.port}")
     print("Press Ctrl+C to stop the server")
     print("\nFeatures:")
     print("- Real-time CPU/GPU monitoring")
@@ -756,5 +3123,25 @@ if __name__ == '__main__':
     print("- Process-level details")
     print("- GPU process detection (NVIDIA)")
     
-    # Run the Flask app
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    if args.aggregator:
+        print("- Aggregating pushes from agents (--agent)")
+        if not agent_token:
+            print("  Warning: agent pushes are not authenticated (set --agent-token)")
+    
+    # Collect in the background so requests only read the latest snapshot
+    if args.archive_dir:
+        archive = MetricsArchive(args.archive_dir, retention=args.archive_retention_days * 86400)
+        sampler.add_listener(archive.record)
+        usage.persist_to(os.path.join(args.archive_dir, 'usage.jsonl'))
+        atexit.register(usage.checkpoint)
+    
+    if args.server == 'asgi':
+        import uvicorn
+        # The sampler is started by the ASGI lifespan handler
+        uvicorn.run(asgi_app, host='0.0.0.0', port=args.port, log_level='warning',
+                    backlog=ASGI_BACKLOG, timeout_keep_alive=STREAM_KEEPALIVE)
+    else:
+        sampler.start()
+        
+        # Run the Flask app
+        app.run(host='0.0.0.0', port=args.port, debug=False)
@@ -0,0 +1,555 @@
+// Processes listed per user card; the server sends only these
+const PROCESSES_SHOWN = 3;
+
+class SystemMonitor {
+    constructor() {
+        this.seq = 0;
+        this.state = null;
+        this.cpuHistory = [];
+        this.gpuHistory = [];
+        this.maxHistoryPoints = 60;
+
+        // Keyed user cards, rendered within a per-frame time budget
+        this.userCards = new Map();
+        this.pendingUsers = [];
+        this.renderIndex = 0;
+        this.renderScheduled = false;
+        this.renderBudgetMs = 8;
+        this.emptyMessage = document.createElement('div');
+        this.emptyMessage.style.cssText = 'text-align: center; opacity: 0.6; padding: 20px;';
+        this.emptyMessage.textContent = 'No active users detected';
+
+        this.initCharts();
+        this.loadHistory().then(() => this.startMonitoring());
+    }
+
+    async loadHistory() {
+        // Backfill the charts from the server instead of starting empty
+        try {
+            const response = await fetch(`/api/history?seconds=600&user=`);
+            const history = await response.json();
+            this.cpuHistory = history.host.cpu.slice(-this.maxHistoryPoints);
+            this.gpuHistory = history.host.gpu.slice(-this.maxHistoryPoints);
+            this.drawCharts();
+        } catch (error) {
+            console.error('Failed to load history:', error);
+        }
+    }
+
+    initCharts() {
+        this.cpuChart = document.getElementById('cpu-chart');
+        this.cpuCtx = this.cpuChart.getContext('2d');
+        this.cpuChart.width = this.cpuChart.offsetWidth;
+        this.cpuChart.height = this.cpuChart.offsetHeight;
+
+        this.gpuChart = document.getElementById('gpu-chart');
+        this.gpuCtx = this.gpuChart.getContext('2d');
+        this.gpuChart.width = this.gpuChart.offsetWidth;
+        this.gpuChart.height = this.gpuChart.offsetHeight;
+    }
+
+    async fetchSystemData() {
+        try {
+            const response = await fetch(`/api/system-data?since=${this.seq}&top=${PROCESSES_SHOWN}`);
+            return this.applyUpdate(await response.json());
+        } catch (error) {
+            console.error('Failed to fetch system data:', error);
+            return null;
+        }
+    }
+
+    applyUpdate(update) {
+        // Returns the merged snapshot, or null if the update does not apply to our state
+        if (update.full) {
+            this.state = update.data;
+            this.seq = update.seq;
+            return this.state;
+        }
+        if (!this.state || update.base !== this.seq) {
+            this.seq = 0;
+            return null;
+        }
+
+        const users = new Map(this.state.users.map(user => [user.username, user]));
+        update.users.removed.forEach(username => users.delete(username));
+        update.users.added.forEach(user => users.set(user.username, user));
+        update.users.changed.forEach(change => {
+            const user = users.get(change.username);
+            if (!user) return;
+            const { processes, ...fields } = change;
+            Object.assign(user, fields);
+            if (processes) {
+                const procs = new Map(user.processes.map(proc => [proc.pid, proc]));
+                processes.removed.forEach(pid => procs.delete(pid));
+                processes.added.forEach(proc => procs.set(proc.pid, proc));
+                processes.changed.forEach(proc => procs.set(proc.pid, proc));
+                user.processes = [...procs.values()].sort((a, b) => b.cpu_percent - a.cpu_percent);
+            }
+        });
+
+        this.state = { ...this.state, ...update.data };
+        this.state.users = [...users.values()].sort((a, b) => b.cpu_usage - a.cpu_usage);
+        this.seq = update.seq;
+        return this.state;
+    }
+
+    updateUI(data) {
+        if (!data) return;
+
+        // Update total CPU
+        const cpuFill = document.getElementById('cpu-fill');
+        const cpuText = document.getElementById('cpu-text');
+        cpuFill.style.width = `${data.cpu.usage}%`;
+        cpuText.textContent = `${Math.round(data.cpu.usage)}%`;
+
+        // Update total GPU
+        const gpuFill = document.getElementById('gpu-fill');
+        const gpuText = document.getElementById('gpu-text');
+        gpuFill.style.width = `${data.gpu.usage}%`;
+        gpuText.textContent = `${Math.round(data.gpu.usage)}%`;
+        document.getElementById('gpu-devices').innerHTML = data.gpu.devices.length > 1
+            ? data.gpu.devices.map(gpu => `
+                <div>GPU ${gpu.index}: ${Math.round(gpu.usage)}% | ${(gpu.memory_used / 1024).toFixed(1)} / ${(gpu.memory_total / 1024).toFixed(1)} GB</div>
+            `).join('')
+            : '';
+
+        if (data.alerts) {
+            this.updateAlerts(data.alerts.active);
+        }
+
+        // Update users
+        this.updateUsersGrid(data.users);
+        if (data.cluster) {
+            this.updateCluster(data.cluster);
+        }
+
+        // Update additional info
+        document.getElementById('cpu-temp').textContent = data.cpu.temperature;
+        document.getElementById('gpu-temp').textContent = data.gpu.temperature;
+        document.getElementById('ram-usage').textContent = data.memory.display;
+        document.getElementById('active-users').textContent = data.active_user_count;
+        document.getElementById('disk-io').textContent = `${formatRate(data.io.disk_read_rate)} / ${formatRate(data.io.disk_write_rate)}`;
+        document.getElementById('net-io').textContent = `${formatRate(data.io.net_recv_rate)} / ${formatRate(data.io.net_sent_rate)}`;
+
+        // Update timestamp
+        document.getElementById('last-updated').textContent = `Last updated: ${new Date().toLocaleTimeString()}`;
+
+        // Update history
+        this.cpuHistory.push(data.cpu.usage);
+        this.gpuHistory.push(data.gpu.usage);
+
+        if (this.cpuHistory.length > this.maxHistoryPoints) {
+            this.cpuHistory.shift();
+            this.gpuHistory.shift();
+        }
+
+        this.drawCharts();
+    }
+
+    updateUsersGrid(users) {
+        // Render the newest list on the next frame; a render in progress picks it up
+        this.pendingUsers = users;
+        this.renderIndex = 0;
+        if (!this.renderScheduled) {
+            this.renderScheduled = true;
+            requestAnimationFrame(() => this.renderUsers());
+        }
+    }
+
+    renderUsers() {
+        const grid = document.getElementById('users-grid');
+        const users = this.pendingUsers;
+        const started = performance.now();
+
+        if (this.renderIndex === 0) {
+            // Drop cards of users that are gone before reordering the rest
+            const current = new Set(users.map(user => user.username));
+            for (const [username, card] of this.userCards) {
+                if (!current.has(username)) {
+                    card.root.remove();
+                    this.userCards.delete(username);
+                }
+            }
+            this.emptyMessage.style.display = users.length === 0 ? '' : 'none';
+            if (!this.emptyMessage.parentNode) {
+                grid.appendChild(this.emptyMessage);
+            }
+        }
+
+        // Keyed update: reuse each user's card and only move it when its position changes
+        while (this.renderIndex < users.length) {
+            const user = users[this.renderIndex];
+            let card = this.userCards.get(user.username);
+            if (!card) {
+                card = this.createUserCard(user.username);
+                this.userCards.set(user.username, card);
+            }
+            this.updateUserCard(card, user);
+            const slot = grid.children[this.renderIndex];
+            if (slot !== card.root) {
+                grid.insertBefore(card.root, slot || null);
+            }
+            this.renderIndex++;
+
+            if (performance.now() - started > this.renderBudgetMs) {
+                // Out of budget for this frame; continue on the next one
+                requestAnimationFrame(() => this.renderUsers());
+                return;
+            }
+        }
+        this.renderScheduled = false;
+    }
+
+    createUserCard(username) {
+        const root = document.createElement('div');
+        root.className = 'user-card';
+        root.innerHTML = `
+            <div class="user-header">
+                <div class="user-name"></div>
+                <div class="user-status"></div>
+            </div>
+            <div class="user-metrics">
+                <div class="user-metric">
+                    <div class="user-metric-label">CPU Usage</div>
+                    <div class="user-metric-value" data-field="cpu"></div>
+                </div>
+                <div class="user-metric">
+                    <div class="user-metric-label">RAM Usage</div>
+                    <div class="user-metric-value" data-field="ram"></div>
+                </div>
+                <div class="user-metric" data-field="gpu-metric">
+                    <div class="user-metric-label" data-field="gpu-label"></div>
+                    <div class="user-metric-value" data-field="gpu"></div>
+                </div>
+                <div class="user-metric" data-field="gpu-memory-metric">
+                    <div class="user-metric-label">GPU Memory</div>
+                    <div class="user-metric-value" data-field="gpu-memory"></div>
+                </div>
+                <div class="user-metric" data-field="io-metric">
+                    <div class="user-metric-label">Disk I/O (read / write)</div>
+                    <div class="user-metric-value" data-field="io"></div>
+                </div>
+            </div>
+            <div class="process-list"></div>
+        `;
+        root.querySelector('.user-name').textContent = username;
+
+        const field = name => root.querySelector(`[data-field="${name}"]`);
+        const processList = root.querySelector('.process-list');
+        const processes = [];
+        for (let i = 0; i < PROCESSES_SHOWN; i++) {
+            const item = document.createElement('div');
+            item.className = 'process-item';
+            item.innerHTML = '<div class="process-name"></div><div class="process-stats"></div><div class="job-children"></div>';
+            const slot = {
+                root: item,
+                name: item.querySelector('.process-name'),
+                stats: item.querySelector('.process-stats'),
+                children: item.querySelector('.job-children'),
+                pid: null,
+                jobSize: 1
+            };
+            item.addEventListener('click', () => this.toggleJob(slot));
+            processes.push(slot);
+            processList.appendChild(item);
+        }
+        const more = document.createElement('div');
+        more.className = 'process-item';
+        more.style.textAlign = 'center';
+        more.style.opacity = '0.6';
+        processList.appendChild(more);
+
+        return {
+            root,
+            status: root.querySelector('.user-status'),
+            cpu: field('cpu'),
+            ram: field('ram'),
+            gpuMetric: field('gpu-metric'),
+            gpuLabel: field('gpu-label'),
+            gpu: field('gpu'),
+            gpuMemoryMetric: field('gpu-memory-metric'),
+            gpuMemory: field('gpu-memory'),
+            ioMetric: field('io-metric'),
+            io: field('io'),
+            processList,
+            processes,
+            more
+        };
+    }
+
+    updateUserCard(card, user) {
+        const isActive = user.cpu_usage > 5 || user.processes.length > 0;
+        setText(card.status, isActive ? 'Active' : 'Idle');
+        setClass(card.status, 'user-inactive', !isActive);
+        setText(card.cpu, `${user.cpu_usage.toFixed(1)}%`);
+        setText(card.ram, `${user.memory_usage.toFixed(1)}%`);
+
+        const usesGpu = user.gpu_memory > 0;
+        setVisible(card.gpuMetric, usesGpu);
+        setVisible(card.gpuMemoryMetric, usesGpu);
+        if (usesGpu) {
+            setText(card.gpuLabel, `GPU Usage (${user.gpu_devices.map(index => `#${index}`).join(', ')})`);
+            setText(card.gpu, `${user.gpu_usage.toFixed(1)}%`);
+            setText(card.gpuMemory, `${(user.gpu_memory / 1024).toFixed(1)} GB`);
+        }
+
+        const doesIo = user.io_read_rate + user.io_write_rate > 0;
+        setVisible(card.ioMetric, doesIo);
+        if (doesIo) {
+            setText(card.io, `${formatRate(user.io_read_rate)} / ${formatRate(user.io_write_rate)}`);
+        }
+
+        setVisible(card.processList, user.processes.length > 0);
+        card.processes.forEach((slot, i) => {
+            const proc = user.processes[i];
+            setVisible(slot.root, Boolean(proc));
+            if (proc) {
+                if (slot.pid !== proc.pid) {
+                    // The slot now shows another job; drop the old one's members
+                    slot.pid = proc.pid;
+                    slot.children.replaceChildren();
+                }
+                slot.jobSize = proc.job_size || 1;
+                setClass(slot.root, 'job-expandable', slot.jobSize > 1);
+                setText(slot.name, slot.jobSize > 1 ? `${proc.name} (${slot.jobSize} processes)` : proc.name);
+                const io = proc.read_rate || proc.write_rate
+                    ? ` | I/O: ${formatRate(proc.read_rate)} / ${formatRate(proc.write_rate)}` : '';
+                setText(slot.stats, `CPU: ${proc.cpu_percent}% | RAM: ${proc.memory_mb}MB${proc.gpu_memory ? ` | GPU: ${proc.gpu_memory}MB` : ''}${io}`);
+            }
+        });
+        const hidden = user.process_count - card.processes.length;
+        setVisible(card.more, hidden > 0);
+        if (hidden > 0) {
+            setText(card.more, `+${hidden} more jobs...`);
+        }
+    }
+
+    async toggleJob(slot) {
+        if (slot.jobSize < 2) return;
+        if (slot.children.childElementCount) {
+            slot.children.replaceChildren();
+            return;
+        }
+        // Members are fetched on demand so the payload carries one entry per job
+        const pid = slot.pid;
+        try {
+            const response = await fetch(`/api/jobs/${pid}`);
+            if (!response.ok || slot.pid !== pid) return;
+            const job = await response.json();
+            slot.children.replaceChildren(...job.processes.map(proc => {
+                const line = document.createElement('div');
+                line.className = 'job-child';
+                line.style.paddingLeft = `${proc.depth * 12}px`;
+                line.textContent = `${proc.name} (${proc.pid}) CPU: ${proc.cpu_percent}% | RAM: ${proc.memory_mb}MB`;
+                return line;
+            }));
+        } catch (error) {
+            console.error('Failed to load job members:', error);
+        }
+    }
+
+    updateAlerts(active) {
+        const container = document.getElementById('alerts');
+        setVisible(container, active.length > 0);
+        const text = active.map(alert => alert.message).join('\n');
+        if (container.dataset.text !== text) {
+            container.dataset.text = text;
+            container.replaceChildren(...active.map(alert => {
+                const item = document.createElement('div');
+                item.className = 'alert-item';
+                item.textContent = `${alert.message} since ${new Date(alert.since * 1000).toLocaleTimeString()}`;
+                return item;
+            }));
+        }
+    }
+
+    updateCluster(cluster) {
+        document.getElementById('cluster-section').style.display = cluster.hosts.length ? '' : 'none';
+
+        // Host and user names come from agents, so they are only ever set as text
+        document.getElementById('cluster-hosts').replaceChildren(...cluster.hosts.map(host => createClusterCard(
+            host.host,
+            host.stale ? `Stale (${Math.round(host.age)}s)` : 'Live',
+            host.stale,
+            [
+                ['CPU Usage', `${host.cpu_usage.toFixed(1)}%`],
+                ['GPU Usage', `${host.gpu_usage.toFixed(1)}%`],
+                ['RAM', host.memory],
+                ['Active Users', `${host.active_user_count}`]
+            ],
+            []
+        )));
+
+        document.getElementById('cluster-users').replaceChildren(...cluster.users.map(user => createClusterCard(
+            user.username,
+            `${Object.keys(user.hosts).length} host(s)`,
+            false,
+            [
+                ['CPU Usage', `${user.cpu_usage.toFixed(1)}%`],
+                ['RAM', `${user.memory_gb.toFixed(1)} GB`]
+            ],
+            Object.entries(user.hosts).map(([host, cpu]) => `${host}: CPU ${cpu}%`)
+        )));
+    }
+
+    drawCharts() {
+        this.drawChart(this.cpuCtx, this.cpuHistory, '#4CAF50');
+        this.drawChart(this.gpuCtx, this.gpuHistory, '#FF9800');
+    }
+
+    drawChart(ctx, data, color) {
+        const canvas = ctx.canvas;
+        ctx.clearRect(0, 0, canvas.width, canvas.height);
+
+        if (data.length < 2) return;
+
+        const padding = 20;
+        const width = canvas.width - padding * 2;
+        const height = canvas.height - padding * 2;
+
+        // Draw grid
+        ctx.strokeStyle = 'rgba(255, 255, 255, 0.1)';
+        ctx.lineWidth = 1;
+
+        for (let i = 0; i <= 4; i++) {
+            const y = padding + (height / 4) * i;
+            ctx.beginPath();
+            ctx.moveTo(padding, y);
+            ctx.lineTo(canvas.width - padding, y);
+            ctx.stroke();
+        }
+
+        // Draw data line
+        ctx.strokeStyle = color;
+        ctx.lineWidth = 2;
+        ctx.beginPath();
+
+        for (let i = 0; i < data.length; i++) {
+            const x = padding + (width / (data.length - 1)) * i;
+            const y = padding + height - (data[i] / 100) * height;
+
+            if (i === 0) {
+                ctx.moveTo(x, y);
+            } else {
+                ctx.lineTo(x, y);
+            }
+        }
+
+        ctx.stroke();
+
+        // Fill area under curve
+        ctx.lineTo(canvas.width - padding, canvas.height - padding);
+        ctx.lineTo(padding, canvas.height - padding);
+        ctx.closePath();
+
+        const gradient = ctx.createLinearGradient(0, padding, 0, canvas.height - padding);
+        gradient.addColorStop(0, color + '40');
+        gradient.addColorStop(1, color + '10');
+
+        ctx.fillStyle = gradient;
+        ctx.fill();
+    }
+
+    startMonitoring() {
+        if (window.EventSource) {
+            // Server pushes each new snapshot as it is collected
+            this.openStream();
+            return;
+        }
+
+        const updateData = async () => {
+            const data = await this.fetchSystemData();
+            this.updateUI(data);
+        };
+
+        updateData();
+        this.pollTimer = setInterval(updateData, 3000); // Update every 3 seconds for user data
+    }
+
+    openStream() {
+        this.stream = new EventSource(`/api/stream?top=${PROCESSES_SHOWN}`);
+        this.stream.onmessage = (event) => {
+            const data = this.applyUpdate(JSON.parse(event.data));
+            if (data) {
+                this.updateUI(data);
+            } else {
+                // Missed an update; reconnecting without an id triggers a full resync
+                this.stream.close();
+                this.openStream();
+            }
+        };
+        this.stream.onerror = (error) => console.error('System data stream error:', error);
+    }
+
+    resize() {
+        this.initCharts();
+        this.drawCharts();
+    }
+}
+
+// DOM writes are skipped when the value is unchanged, so steady cards cause no layout work
+function setText(node, text) {
+    if (node.textContent !== text) {
+        node.textContent = text;
+    }
+}
+
+function setClass(node, className, enabled) {
+    if (node.classList.contains(className) !== enabled) {
+        node.classList.toggle(className, enabled);
+    }
+}
+
+function setVisible(node, visible) {
+    const display = visible ? '' : 'none';
+    if (node.style.display !== display) {
+        node.style.display = display;
+    }
+}
+
+function formatRate(bytesPerSecond) {
+    const units = ['B/s', 'KB/s', 'MB/s', 'GB/s'];
+    let value = bytesPerSecond || 0;
+    let unit = 0;
+    while (value >= 1024 && unit < units.length - 1) {
+        value /= 1024;
+        unit++;
+    }
+    return `${value.toFixed(unit ? 1 : 0)} ${units[unit]}`;
+}
+
+function createClusterCard(name, status, inactive, metrics, lines) {
+    const root = document.createElement('div');
+    root.className = 'user-card';
+    const element = (parent, className, text) => {
+        const node = document.createElement('div');
+        node.className = className;
+        if (text !== undefined) {
+            node.textContent = text;
+        }
+        parent.appendChild(node);
+        return node;
+    };
+
+    const header = element(root, 'user-header');
+    element(header, 'user-name', name);
+    element(header, inactive ? 'user-status user-inactive' : 'user-status', status);
+    const metricList = element(root, 'user-metrics');
+    for (const [label, value] of metrics) {
+        const metric = element(metricList, 'user-metric');
+        element(metric, 'user-metric-label', label);
+        element(metric, 'user-metric-value', value);
+    }
+    if (lines.length) {
+        const processList = element(root, 'process-list');
+        for (const line of lines) {
+            element(element(processList, 'process-item'), 'process-stats', line);
+        }
+    }
+    return root;
+}
+
+window.addEventListener('load', () => {
+    const monitor = new SystemMonitor();
+    window.addEventListener('resize', () => monitor.resize());
+});